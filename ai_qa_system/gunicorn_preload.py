@@ -0,0 +1,20 @@
+"""
+Gunicorn settings used by "manage.py loadtest".
+
+The application, its URLconf and the NLP models are loaded once in the master
+before the workers are forked, so every worker serves its first request warm
+and the measurements do not include model loading.
+"""
+
+preload_app = True
+
+
+def when_ready(server):
+    """Import the URLconf and load the NLP models before any worker is started."""
+    from django.urls import get_resolver
+
+    from knowledge.utils import load_language_models
+
+    # Django imports the URLconf (and with it the views) lazily on the first request
+    get_resolver().url_patterns
+    load_language_models()
@@ -88,8 +88,76 @@ DATABASES = {
         'PORT': config("DATABASE_PORT"),
     }
 }
+
+# Document shards
+# Documents can be spread over several databases on the same server, named in
+# DOCUMENT_SHARD_DATABASES (e.g. "qa_shard_0,qa_shard_1"); searches query all
+# shards concurrently. Without it, documents live in the default database.
+
+DOCUMENT_SHARD_DATABASES = [
+    name.strip() for name in config("DOCUMENT_SHARD_DATABASES", default="").split(",") if name.strip()
+]
+# Shard queries run on a pool of threads that keep their connections open for
+# SHARD_CONN_MAX_AGE seconds; 0 opens a new connection for every shard query.
+SHARD_CONN_MAX_AGE = config("SHARD_CONN_MAX_AGE", default=600, cast=int)
+for index, name in enumerate(DOCUMENT_SHARD_DATABASES):
+    DATABASES[f"shard_{index}"] = {
+        **DATABASES["default"],
+        "NAME": name,
+        "CONN_MAX_AGE": SHARD_CONN_MAX_AGE,
+        "CONN_HEALTH_CHECKS": True,
+    }
+
+DOCUMENT_SHARDS = [f"shard_{index}" for index in range(len(DOCUMENT_SHARD_DATABASES))] or ["default"]
+SHARD_QUERY_THREADS_PER_SHARD = config("SHARD_QUERY_THREADS_PER_SHARD", default=4, cast=int)
+DATABASE_ROUTERS = ["knowledge.routers.DocumentShardRouter"]
+
 OPENAI_API_KEY = config("OPENAI_API_KEY")
 
+# Embedding model of a fresh install; later models are rolled out with
+# "manage.py reembed_documents <model>" without downtime.
+EMBEDDING_MODEL = config("EMBEDDING_MODEL", default="text-embedding-ada-002")
+
+# Coarse-to-fine retrieval: pick the files closest to the query by their
+# file/class centroid embeddings, then search chunks only within those files.
+# It is approximate, so enable it only once "manage.py benchmark_retrieval"
+# shows acceptable recall on the ingested corpus.
+HIERARCHICAL_SEARCH = config("HIERARCHICAL_SEARCH", default=False, cast=bool)
+HIERARCHICAL_TOP_FILES = config("HIERARCHICAL_TOP_FILES", default=5, cast=int)
+HIERARCHICAL_TOP_CLASSES = config("HIERARCHICAL_TOP_CLASSES", default=5, cast=int)
+
+
+# Cache
+# Query responses and the single-flight locks that coalesce identical
+# concurrent queries live here, so gunicorn workers must share it. Without
+# REDIS_URL each worker has its own LocMemCache: responses are cached and
+# identical queries coalesced per worker only.
+
+REDIS_URL = config("REDIS_URL", default="")
+# Namespace of the cache keys; the load test gives every server it starts its own.
+CACHE_KEY_PREFIX = config("CACHE_KEY_PREFIX", default="")
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': CACHE_KEY_PREFIX,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'KEY_PREFIX': CACHE_KEY_PREFIX,
+        }
+    }
+
+
+# Profiles and reports of requests profiled by staff users ("X-Profile" header
+# or "?profile=" on the query API and chat page)
+PROFILE_DIR = config("PROFILE_DIR", default=str(BASE_DIR / "profiles"))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
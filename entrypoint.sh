@@ -2,6 +2,7 @@
 
 echo "Applying database migrations..."
 python manage.py migrate --noinput
+python manage.py migrate_shards
 
 echo "Collecting static files..."
 python manage.py collectstatic --noinput
@@ -0,0 +1,51 @@
+from django.db import connections, transaction
+
+
+EMBEDDING_COLUMNS = {"embedding", "embedding_next"}
+
+
+def rebuild_centroids(column, model, using="default"):
+    """
+    Recompute file-level and class-level centroid embeddings from the documents.
+
+    A file centroid is the mean embedding of every function and class in the
+    file; a class centroid is the mean embedding of the class and its methods.
+    Centroids are stored per embedding model, so centroids for a model being
+    migrated to can be built while searches still use the current ones.
+
+    Args:
+        column (str): The document column to average ("embedding" or "embedding_next").
+        model (str): The embedding model behind that column.
+        using (str, optional): The database alias (shard) whose documents are averaged. Defaults to "default".
+
+    Returns:
+        int: The number of centroids stored.
+    """
+    if column not in EMBEDDING_COLUMNS:
+        raise ValueError(f"Unknown embedding column: {column}")
+
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute("DELETE FROM code_centroid WHERE embedding_model = %s;", [model])
+        cursor.execute(
+            f"""
+            INSERT INTO code_centroid (scope, file_path, name, embedding, embedding_model, member_count)
+            SELECT 'file', file_path, '', AVG({column}), %s, COUNT(*)
+            FROM document
+            WHERE {column} IS NOT NULL
+            GROUP BY file_path;
+            """,
+            [model]
+        )
+        file_count = cursor.rowcount
+        cursor.execute(
+            f"""
+            INSERT INTO code_centroid (scope, file_path, name, embedding, embedding_model, member_count)
+            SELECT 'class', file_path, COALESCE(NULLIF(parent_class, ''), title), AVG({column}), %s, COUNT(*)
+            FROM document
+            WHERE {column} IS NOT NULL AND (kind = 'class' OR parent_class <> '')
+            GROUP BY file_path, COALESCE(NULLIF(parent_class, ''), title);
+            """,
+            [model]
+        )
+        class_count = cursor.rowcount
+    return file_count + class_count
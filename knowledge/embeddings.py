@@ -0,0 +1,81 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from knowledge.models import EmbeddingMigration
+
+from openai import OpenAI
+
+
+# Initialize OpenAI client
+client = OpenAI(api_key=settings.OPENAI_API_KEY)
+
+EMBEDDING_DIMENSIONS = 1536
+READ_STATE_CACHE_KEY = "embedding_read_state"
+READ_STATE_CACHE_TIMEOUT = 10
+
+
+def embed_texts(texts, model):
+    """
+    Fetch embeddings for several texts from OpenAI in one request.
+
+    Args:
+        texts (list): The texts to embed.
+        model (str): The embedding model.
+
+    Returns:
+        list: One embedding vector per text, in input order.
+    """
+    kwargs = {}
+    if model.startswith("text-embedding-3"):
+        # Newer models can shorten their vectors to fit the vector(1536) columns
+        kwargs["dimensions"] = EMBEDDING_DIMENSIONS
+    response = client.embeddings.create(input=texts, model=model, **kwargs)
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+
+def get_active_migration():
+    """
+    Return the re-embedding migration in progress, if any.
+
+    Returns:
+        EmbeddingMigration: The running or cut-over migration, or None.
+    """
+    return EmbeddingMigration.objects.exclude(status="completed").order_by("-created_at").first()
+
+
+def get_primary_embedding_model():
+    """
+    Return the model behind the embedding column.
+
+    Returns:
+        str: The target of the last completed migration, or settings.EMBEDDING_MODEL.
+    """
+    migration = EmbeddingMigration.objects.filter(status="completed").order_by("-created_at").first()
+    return migration.target_model if migration else settings.EMBEDDING_MODEL
+
+
+def get_embedding_read_state():
+    """
+    Return which column searches read and which model embeds queries for it.
+
+    The state is cached briefly; a cut-over or completed migration switches
+    every reader within READ_STATE_CACHE_TIMEOUT seconds, and both columns stay
+    populated meanwhile, so queries keep working throughout.
+
+    Returns:
+        dict: The "column" to search ("embedding" or "embedding_next") and the query embedding "model".
+    """
+    state = cache.get(READ_STATE_CACHE_KEY)
+    if state is None:
+        migration = get_active_migration()
+        if migration and migration.status == "cut_over":
+            state = {"column": "embedding_next", "model": migration.target_model}
+        else:
+            state = {"column": "embedding", "model": get_primary_embedding_model()}
+        cache.set(READ_STATE_CACHE_KEY, state, timeout=READ_STATE_CACHE_TIMEOUT)
+    return state
+
+
+def invalidate_embedding_read_state():
+    """Drop the cached read state after a migration changes status."""
+    cache.delete(READ_STATE_CACHE_KEY)
@@ -0,0 +1,156 @@
+import json
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from knowledge.embeddings import get_embedding_read_state
+from knowledge.shards import get_document_shards
+from knowledge.utils import search_documents_sharded
+
+
+def sample_query_embeddings(count, seed, column):
+    """Sample stored document embeddings from every shard to use as benchmark queries."""
+    shards = get_document_shards()
+    samples = []
+    for shard in shards:
+        with connections[shard].cursor() as cursor:
+            cursor.execute("SELECT setseed(%s);", [seed])
+            cursor.execute(
+                f"""
+                SELECT id, {column}::text
+                FROM document
+                WHERE {column} IS NOT NULL
+                ORDER BY random()
+                LIMIT %s;
+                """,
+                [-(-count // len(shards))]
+            )
+            samples.extend(cursor.fetchall())
+    return samples[:count]
+
+
+def summarize(latencies, recalls, distances, self_hits, shard_latencies):
+    """Aggregate per-query measurements into a report row."""
+    latencies = sorted(latencies)
+    return {
+        "latency_mean_ms": statistics.mean(latencies) * 1000,
+        "latency_p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+        "recall_vs_flat": statistics.mean(recalls),
+        "mean_distance": statistics.mean(distances),
+        "self_hit_rate": statistics.mean(self_hits),
+        "shard_latency_mean_ms": {
+            shard: statistics.mean(values) * 1000 for shard, values in shard_latencies.items()
+        },
+    }
+
+
+def record_shard_latencies(shard_latencies, latencies):
+    """Append one query's per-shard latencies to the running lists."""
+    for shard, latency in latencies.items():
+        shard_latencies.setdefault(shard, []).append(latency)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare flat and coarse-to-fine (centroid) retrieval: latency, overlap "
+        "with flat top-k results and distance of the returned context."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--queries", type=int, default=100, help="Number of sampled query embeddings.")
+        parser.add_argument("--top-k", type=int, default=3, help="Results per query.")
+        parser.add_argument(
+            "--top-files", type=int, action="append",
+            help="File breadth to benchmark. Repeatable. Defaults to settings.HIERARCHICAL_TOP_FILES.",
+        )
+        parser.add_argument(
+            "--top-classes", type=int, default=settings.HIERARCHICAL_TOP_CLASSES,
+            help="Class breadth. Defaults to settings.HIERARCHICAL_TOP_CLASSES.",
+        )
+        parser.add_argument("--seed", type=float, default=0.42, help="Sampling seed between -1 and 1.")
+        parser.add_argument("--output", help="Write the report as JSON to this file.")
+
+    def handle(self, *args, **options):
+        top_k = options["top_k"]
+        breadths = options["top_files"] or [settings.HIERARCHICAL_TOP_FILES]
+        read_state = get_embedding_read_state()
+        column = read_state["column"]
+        samples = sample_query_embeddings(options["queries"], options["seed"], column)
+        if not samples:
+            raise CommandError("No embedded documents to benchmark.")
+
+        document_count = 0
+        centroid_counts = {}
+        for shard in get_document_shards():
+            with connections[shard].cursor() as cursor:
+                cursor.execute("SELECT COUNT(*) FROM document;")
+                document_count += cursor.fetchone()[0]
+                cursor.execute(
+                    "SELECT scope, COUNT(*) FROM code_centroid WHERE embedding_model = %s GROUP BY scope;",
+                    [read_state["model"]]
+                )
+                for scope, count in cursor.fetchall():
+                    centroid_counts[scope] = centroid_counts.get(scope, 0) + count
+        self.stdout.write(
+            f"{document_count} documents on {len(get_document_shards())} shard(s), "
+            f"{centroid_counts.get('file', 0)} file centroids, "
+            f"{centroid_counts.get('class', 0)} class centroids, {len(samples)} queries, top_k={top_k}"
+        )
+
+        # Warm up connections and caches so the first strategy is not penalized.
+        search_documents_sharded(samples[0][1], top_k, False, read_state)
+
+        flat = {"latencies": [], "distances": [], "self_hits": [], "ids": [], "shards": {}}
+        for document_id, embedding in samples:
+            started = time.perf_counter()
+            results, shard_latencies = search_documents_sharded(embedding, top_k, False, read_state)
+            flat["latencies"].append(time.perf_counter() - started)
+            record_shard_latencies(flat["shards"], shard_latencies)
+            flat["ids"].append({doc["id"] for doc in results})
+            flat["distances"].append(statistics.mean(doc["distance"] for doc in results))
+            flat["self_hits"].append(document_id in flat["ids"][-1])
+
+        report = [{
+            "strategy": "flat",
+            **summarize(
+                flat["latencies"], [1.0] * len(samples), flat["distances"], flat["self_hits"], flat["shards"]
+            ),
+        }]
+
+        for top_files in breadths:
+            latencies, recalls, distances, self_hits, shards = [], [], [], [], {}
+            for (document_id, embedding), flat_ids in zip(samples, flat["ids"]):
+                started = time.perf_counter()
+                results, shard_latencies = search_documents_sharded(
+                    embedding, top_k, True, read_state,
+                    top_files=top_files, top_classes=options["top_classes"], fallback=False,
+                )
+                latencies.append(time.perf_counter() - started)
+                record_shard_latencies(shards, shard_latencies)
+                ids = {doc["id"] for doc in results}
+                recalls.append(len(ids & flat_ids) / len(flat_ids) if flat_ids else 1.0)
+                distances.append(statistics.mean(doc["distance"] for doc in results) if results else 2.0)
+                self_hits.append(document_id in ids)
+            report.append({
+                "strategy": f"hierarchical files={top_files} classes={options['top_classes']}",
+                **summarize(latencies, recalls, distances, self_hits, shards),
+            })
+
+        for row in report:
+            self.stdout.write(
+                f"{row['strategy']:<36} mean={row['latency_mean_ms']:7.2f}ms  p95={row['latency_p95_ms']:7.2f}ms  "
+                f"recall@{top_k}={row['recall_vs_flat']:.3f}  distance={row['mean_distance']:.4f}  "
+                f"self-hit={row['self_hit_rate']:.3f}"
+            )
+            if len(row["shard_latency_mean_ms"]) > 1:
+                self.stdout.write("    " + "  ".join(
+                    f"{shard}={latency:.2f}ms" for shard, latency in row["shard_latency_mean_ms"].items()
+                ))
+
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Report written to {options['output']}")
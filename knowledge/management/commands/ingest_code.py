@@ -1,20 +1,36 @@
 import ast
 import os
 import pickle
+import resource
+import sys
+import time
 
 from django.core.management.base import BaseCommand
 from django.conf import settings
 
 from gensim.models import Word2Vec
 
+from knowledge.centroids import rebuild_centroids
+from knowledge.embeddings import (
+    embed_texts,
+    get_active_migration,
+    get_embedding_read_state,
+    get_primary_embedding_model,
+    invalidate_embedding_read_state,
+)
 from knowledge.models import Document
+from knowledge.shards import get_document_databases, get_document_shards, shard_for_chunk
+from knowledge.symbols import identifier_tokens
 
-from openai import OpenAI
 
-
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
 TOKEN_LIMIT = 512
 
+# Fields refreshed when a chunk is ingested again
+DOCUMENT_UPDATE_FIELDS = [
+    "title", "content", "docstring", "file_path", "embedding", "embedding_model", "embedding_next",
+    "embedding_next_model", "kind", "start_line", "end_line", "identifier_tokens", "parent_class",
+]
+
 
 def extract_functions_from_file(file_path):
     """Extract function/class names, code, and docstrings from a Python file."""
@@ -25,18 +41,27 @@ def extract_functions_from_file(file_path):
     functions = []
     tokens = []
 
+    # Map methods and nested classes to their enclosing class
+    parents = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ClassDef):
+            for child in node.body:
+                if isinstance(child, (ast.FunctionDef, ast.ClassDef)):
+                    parents[child] = node.name
+
     for node in ast.walk(tree):
         if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
             name = node.name
+            kind = "class" if isinstance(node, ast.ClassDef) else "function"
             start_line = node.lineno
-            end_line = node.body[-1].lineno if node.body else start_line
+            end_line = node.end_lineno or start_line
 
             function_code = "\n".join(content.splitlines()[start_line - 1:end_line])
 
             # Extract docstring if available
             docstring = ast.get_docstring(node) or ""
 
-            functions.append((name, function_code, docstring))
+            functions.append((name, function_code, docstring, kind, start_line, end_line, parents.get(node, "")))
 
             # Tokenize function name, code, and docstring for Word2Vec
             tokens.append(name.split("_") + function_code.split() + docstring.split())
@@ -44,15 +69,53 @@ def extract_functions_from_file(file_path):
     return functions, tokens
 
 
+def make_chunk_id(file_path, name, parent_class=""):
+    """
+    Build the key of a chunk: its file path and its name qualified by the enclosing class.
+
+    Args:
+        file_path (str): The path of the source file, as stored on the document.
+        name (str): The function or class name.
+        parent_class (str, optional): The enclosing class of a method. Defaults to "".
+
+    Returns:
+        str: The chunk_id, e.g. "repo/knowledge/views.py:QueryView.post".
+    """
+    qualified_name = f"{parent_class}.{name}" if parent_class else name
+    return f"{file_path}:{qualified_name}"
+
+
 def save_to_database(file_path):
     """Save extracted functions along with docstrings to the database."""
     functions, tokens = extract_functions_from_file(file_path)
 
+    # While a re-embedding migration is in progress, write both embeddings so
+    # new documents are covered whichever column searches read.
+    migration = get_active_migration()
+    if migration is None:
+        embedding_model, next_model = get_primary_embedding_model(), ""
+    elif migration.status == "cut_over":
+        embedding_model, next_model = migration.target_model, migration.target_model
+    else:
+        embedding_model, next_model = migration.source_model, migration.target_model
+
     documents_to_create = []
-    for name, code, docstring in functions:
-        chunk_id = f"{os.path.basename(file_path)}-{name}"
-        embedding_response = client.embeddings.create(input=[code + " " + docstring], model="text-embedding-ada-002")
-        embedding = embedding_response.data[0].embedding
+    chunk_ids = set()
+    for name, code, docstring, kind, start_line, end_line, parent_class in functions:
+        chunk_id = make_chunk_id(file_path, name, parent_class)
+        if chunk_id in chunk_ids:
+            # Redefinitions in the same scope (e.g. property setters, nested helpers);
+            # one upsert statement cannot write the same key twice
+            chunk_id = f"{chunk_id}@{start_line}"
+        chunk_ids.add(chunk_id)
+        text = code + " " + docstring
+        embedding = embed_texts([text], embedding_model)[0]
+        if not next_model:
+            embedding_next = None
+        elif next_model == embedding_model:
+            embedding_next = embedding
+        else:
+            embedding_next = embed_texts([text], next_model)[0]
 
         documents_to_create.append(
             Document(
@@ -61,39 +124,154 @@ def save_to_database(file_path):
                 docstring=docstring,  # Store docstring separately
                 chunk_id=chunk_id,
                 file_path=file_path,
-                embedding=embedding
+                embedding=embedding,
+                embedding_model=embedding_model,
+                embedding_next=embedding_next,
+                embedding_next_model=next_model,
+                kind=kind,
+                start_line=start_line,
+                end_line=end_line,
+                identifier_tokens=identifier_tokens(name),
+                parent_class=parent_class,
             )
         )
 
-    Document.objects.bulk_create(documents_to_create, ignore_conflicts=True)
+    # Each document is stored on the shard picked by its chunk_id
+    documents_by_shard = {}
+    for document in documents_to_create:
+        documents_by_shard.setdefault(shard_for_chunk(document.chunk_id), []).append(document)
+    for shard, documents in documents_by_shard.items():
+        # Re-ingesting refreshes existing chunks, including fields added after they were first ingested
+        Document.objects.using(shard).bulk_create(
+            documents, update_conflicts=True, unique_fields=["chunk_id"], update_fields=DOCUMENT_UPDATE_FIELDS
+        )
+    # Drop copies left on other databases by an earlier shard layout, so searches never merge duplicates
+    for database in get_document_databases():
+        stale_chunk_ids = [
+            document.chunk_id for shard, documents in documents_by_shard.items() if shard != database
+            for document in documents
+        ]
+        if stale_chunk_ids:
+            Document.objects.using(database).filter(chunk_id__in=stale_chunk_ids).delete()
     print(f"✅ {len(documents_to_create)} Functions Saved from {file_path}")
 
     return tokens
 
 
-def process_repository(directory_path):
-    """Recursively process all Python files in a directory and train Word2Vec model."""
-    all_tokens = []
-    for root, _, files in os.walk(directory_path):
-        for file in files:
-            if file.endswith(".py"):
-                file_path = os.path.join(root, file)
-                tokens = save_to_database(file_path)
-                all_tokens.extend(tokens)
+class TokenCorpus:
+    """
+    Restartable stream over a line corpus: one function's space-separated tokens per line.
+
+    Each iteration reopens the file, so Word2Vec can make several passes
+    (vocabulary scan and training epochs) without holding the corpus in memory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                tokens = line.split()
+                if tokens:
+                    yield tokens
+
+
+def peak_rss_mb():
+    """Return the peak resident set size of this process in megabytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
 
-    # Train and save Word2Vec model
-    if all_tokens:
-        w2v_model = Word2Vec(all_tokens, vector_size=100, window=5, min_count=1, workers=4)
-        w2v_path = os.path.join(settings.BASE_DIR, "word2vec_model.pkl")
-        with open(w2v_path, "wb") as f:
-            pickle.dump(w2v_model, f)
-        print("✅ Word2Vec model trained and saved!")
+
+def process_repository(directory_path, corpus_path):
+    """Recursively process all Python files in a directory and spill their tokens to a line corpus."""
+    # Write to a temporary file so an interrupted run never leaves a truncated corpus behind
+    partial_path = f"{corpus_path}.partial"
+    with open(partial_path, "w", encoding="utf-8") as corpus:
+        for root, _, files in os.walk(directory_path):
+            for file in files:
+                if file.endswith(".py"):
+                    file_path = os.path.join(root, file)
+                    tokens = save_to_database(file_path)
+                    corpus.writelines(" ".join(function_tokens) + "\n" for function_tokens in tokens)
+    os.replace(partial_path, corpus_path)
+
+    # File and class centroids for coarse-to-fine retrieval
+    invalidate_embedding_read_state()
+    read_state = get_embedding_read_state()
+    centroid_count = sum(
+        rebuild_centroids(read_state["column"], read_state["model"], using=shard) for shard in get_document_shards()
+    )
+    print(f"✅ {centroid_count} File/Class Centroids Computed")
+    print(f"✅ Token corpus written to {corpus_path} (peak RSS {peak_rss_mb():.0f} MB)")
+
+
+def train_word2vec(corpus_path, epochs=5, workers=4, streaming=False):
+    """
+    Train and save a Word2Vec model from a line corpus without loading it into memory.
+
+    Args:
+        corpus_path (str): The line corpus written by process_repository.
+        epochs (int, optional): Training passes over the corpus. Defaults to 5.
+        workers (int, optional): Training threads. Defaults to 4.
+        streaming (bool, optional): Train from a Python iterable instead of gensim's
+            corpus_file mode, whose workers each read their own part of the file
+            and scale better across cores. Defaults to False.
+    """
+    if not os.path.exists(corpus_path) or not os.path.getsize(corpus_path):
+        print("⚠️ Token corpus is empty, skipping Word2Vec training.")
+        return
+
+    started = time.perf_counter()
+    if streaming:
+        w2v_model = Word2Vec(
+            TokenCorpus(corpus_path), vector_size=100, window=5, min_count=1, workers=workers, epochs=epochs
+        )
+    else:
+        w2v_model = Word2Vec(
+            corpus_file=corpus_path, vector_size=100, window=5, min_count=1, workers=workers, epochs=epochs
+        )
+    elapsed = time.perf_counter() - started
+
+    w2v_path = os.path.join(settings.BASE_DIR, "word2vec_model.pkl")
+    with open(w2v_path, "wb") as f:
+        pickle.dump(w2v_model, f)
+
+    words_per_second = w2v_model.corpus_total_words * epochs / elapsed if elapsed else 0
+    print(
+        f"✅ Word2Vec model trained and saved! {w2v_model.corpus_total_words} words x {epochs} epochs "
+        f"in {elapsed:.1f}s ({words_per_second:,.0f} words/s, peak RSS {peak_rss_mb():.0f} MB)"
+    )
 
 
 class Command(BaseCommand):
     help = "Ingest Python functions into the database"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "repo_path", nargs="?", default="path/to/your/repository",
+            help="Repository to ingest.",
+        )
+        parser.add_argument(
+            "--corpus-path", default=os.path.join(settings.BASE_DIR, "word2vec_corpus.txt"),
+            help="Line corpus of function tokens used to train Word2Vec.",
+        )
+        parser.add_argument("--skip-word2vec", action="store_true", help="Only ingest; do not train Word2Vec.")
+        parser.add_argument(
+            "--word2vec-only", action="store_true",
+            help="Only train Word2Vec from an existing corpus, e.g. after an interrupted training.",
+        )
+        parser.add_argument("--epochs", type=int, default=5, help="Word2Vec training epochs.")
+        parser.add_argument("--workers", type=int, default=4, help="Word2Vec training threads.")
+        parser.add_argument(
+            "--streaming", action="store_true",
+            help="Train from a streaming iterable instead of gensim's multi-core corpus_file mode.",
+        )
+
     def handle(self, *args, **kwargs):
-        repo_path = "path/to/your/repository"  # Replace with your repository path"
-        process_repository(repo_path)
-        print("🎯 Repository Ingestion Done!")
+        if not kwargs["word2vec_only"]:
+            process_repository(kwargs["repo_path"], kwargs["corpus_path"])
+            print("🎯 Repository Ingestion Done!")
+        if not kwargs["skip_word2vec"]:
+            train_word2vec(kwargs["corpus_path"], kwargs["epochs"], kwargs["workers"], kwargs["streaming"])
@@ -0,0 +1,425 @@
+import hashlib
+import json
+import os
+import random
+import secrets
+import signal
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from knowledge.models import ChatSession
+
+
+LOADTEST_USERNAME_PREFIX = "loadtest-"
+EMBEDDING_DIMENSIONS = 1536
+SERVER_START_TIMEOUT = 300
+# Loads the app, URLconf and NLP models in the gunicorn master before workers are forked
+GUNICORN_CONFIG = "python:ai_qa_system.gunicorn_preload"
+CLEANUP_BATCH_SIZE = 1000
+REQUEST_TIMEOUT = 120
+
+# The baseline entrypoint runs "--workers=4 --threads=4"; gunicorn switches sync
+# workers to gthread when threads > 1, so "gthread:4:4" is the current setup.
+DEFAULT_SERVER_CONFIGS = ["sync:4", "gthread:4:4", "gthread:8:4", "asgi:4"]
+DEFAULT_CONCURRENCY = [1, 4, 16, 32]
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    """Minimal OpenAI-compatible API answering embeddings and chat completions locally."""
+
+    latency = 0.0
+    answer = "This is a stub answer from the load-test LLM server."
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if self.latency:
+            time.sleep(self.latency)
+
+        if self.path.endswith("/embeddings"):
+            inputs = payload.get("input", "")
+            if not isinstance(inputs, list):
+                inputs = [inputs]
+            body = {
+                "object": "list",
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": stub_embedding(str(text))}
+                    for i, text in enumerate(inputs)
+                ],
+                "model": payload.get("model", "stub"),
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            }
+        elif self.path.endswith("/chat/completions"):
+            body = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": payload.get("model", "stub"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": self.answer},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            }
+        else:
+            self.send_error(404)
+            return
+
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def stub_embedding(text):
+    """Return a deterministic unit-length pseudo-embedding for text."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+    rng = random.Random(seed)
+    vector = [rng.gauss(0, 1) for _ in range(EMBEDDING_DIMENSIONS)]
+    norm = sum(v * v for v in vector) ** 0.5 or 1.0
+    return [v / norm for v in vector]
+
+
+def start_stub_llm_server(latency):
+    """Start the stub LLM server in a background thread and return it."""
+    handler = type("ConfiguredStubLLMHandler", (StubLLMHandler,), {"latency": latency})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def load_queries(path):
+    """
+    Load recorded queries from a JSON-lines log.
+
+    Each line is either a JSON object with a "query" field (or "title" and
+    "body" fields, as in requests.jsonl) or a plain-text query.
+    """
+    queries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                queries.append(line)
+                continue
+            if isinstance(record, dict):
+                query = record.get("query") or record.get("title") or record.get("body")
+            else:
+                query = str(record)
+            if query:
+                queries.append(query)
+    return queries
+
+
+def parse_server_config(spec):
+    """
+    Parse a server configuration spec into a name and gunicorn arguments.
+
+    Supported specs: "sync:<workers>", "gthread:<workers>:<threads>" and
+    "asgi:<workers>" (uvicorn workers serving ai_qa_system.asgi).
+    """
+    parts = spec.split(":")
+    kind = parts[0]
+    try:
+        numbers = [int(part) for part in parts[1:]]
+    except ValueError:
+        raise CommandError(f"Invalid server configuration: {spec}")
+
+    if kind == "sync" and len(numbers) == 1:
+        return spec, ["ai_qa_system.wsgi:application", "--worker-class=sync", f"--workers={numbers[0]}"]
+    if kind == "gthread" and len(numbers) == 2:
+        return spec, [
+            "ai_qa_system.wsgi:application", "--worker-class=gthread",
+            f"--workers={numbers[0]}", f"--threads={numbers[1]}",
+        ]
+    if kind == "asgi" and len(numbers) == 1:
+        return spec, [
+            "ai_qa_system.asgi:application", "--worker-class=uvicorn.workers.UvicornWorker",
+            f"--workers={numbers[0]}",
+        ]
+    raise CommandError(f"Invalid server configuration: {spec}")
+
+
+def percentile(values, pct):
+    """Return the pct-th percentile of a sorted list of values."""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, int(round(pct / 100 * len(values))) - 1))
+    return values[index]
+
+
+class LoadTestClient:
+    """An authenticated session against the application, with its own cookies."""
+
+    def __init__(self, base_url, username, password):
+        self.base_url = base_url.rstrip("/")
+        self.session_ids = []
+        self.cookies = CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies))
+        self.login(username, password)
+
+    def csrf_token(self):
+        for cookie in self.cookies:
+            if cookie.name == settings.CSRF_COOKIE_NAME:
+                return cookie.value
+        return ""
+
+    def login(self, username, password):
+        self.opener.open(f"{self.base_url}/accounts/login/", timeout=REQUEST_TIMEOUT).read()
+        data = urllib.parse.urlencode({
+            "username": username,
+            "password": password,
+            "csrfmiddlewaretoken": self.csrf_token(),
+        }).encode("utf-8")
+        request = urllib.request.Request(
+            f"{self.base_url}/accounts/login/", data=data,
+            headers={"Referer": f"{self.base_url}/accounts/login/"},
+        )
+        self.opener.open(request, timeout=REQUEST_TIMEOUT).read()
+        if not any(cookie.name == settings.SESSION_COOKIE_NAME for cookie in self.cookies):
+            raise CommandError("Load-test user could not log in.")
+
+    def query(self, query):
+        """Send a query in a new chat session and return the HTTP status (0 on connection errors)."""
+        # Sessions are named by the client so the command can delete them afterwards
+        session_id = str(uuid.uuid4())
+        self.session_ids.append(session_id)
+        request = urllib.request.Request(
+            f"{self.base_url}/api/query/",
+            data=json.dumps({"query": query, "session_id": session_id}).encode("utf-8"),
+            headers={
+                "Content-Type": "application/json",
+                "X-CSRFToken": self.csrf_token(),
+                "Referer": f"{self.base_url}/chat/",
+            },
+        )
+        try:
+            with self.opener.open(request, timeout=REQUEST_TIMEOUT) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+        except (urllib.error.URLError, OSError):
+            return 0
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a recorded query log against /api/query/ for a sweep of server "
+        "configurations and concurrency levels, using a stub LLM server, and "
+        "report throughput, latency and errors."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("query_log", help="JSON-lines file of recorded queries (e.g. requests.jsonl)")
+        parser.add_argument(
+            "--config", action="append", dest="configs",
+            help="Server configuration: sync:<workers>, gthread:<workers>:<threads> or asgi:<workers>. "
+                 f"Repeatable. Defaults to {' '.join(DEFAULT_SERVER_CONFIGS)}.",
+        )
+        parser.add_argument(
+            "--concurrency", type=int, action="append",
+            help=f"Concurrent clients. Repeatable. Defaults to {DEFAULT_CONCURRENCY}.",
+        )
+        parser.add_argument(
+            "--requests", type=int, default=0,
+            help="Requests per concurrency level. Defaults to the number of queries in the log.",
+        )
+        parser.add_argument("--port", type=int, default=8765, help="Port for the servers under test.")
+        parser.add_argument(
+            "--startup-timeout", type=int, default=SERVER_START_TIMEOUT,
+            help="Seconds to wait for a server to answer (workers load NLP models on first request).",
+        )
+        parser.add_argument(
+            "--url", help="Test an already running server at this URL instead of starting gunicorn.",
+        )
+        parser.add_argument(
+            "--llm-latency", type=float, default=0.0,
+            help="Seconds the stub LLM server waits before each response.",
+        )
+        parser.add_argument("--output", help="Write the report as JSON to this file.")
+
+    def handle(self, *args, **options):
+        queries = load_queries(options["query_log"])
+        if not queries:
+            raise CommandError("The query log contains no queries.")
+        levels = options["concurrency"] or DEFAULT_CONCURRENCY
+        total_requests = options["requests"] or len(queries)
+
+        # A throwaway account, so no existing user is touched and no login is left behind
+        username = f"{LOADTEST_USERNAME_PREFIX}{secrets.token_hex(8)}"
+        password = secrets.token_urlsafe(16)
+        user = User.objects.create_user(username=username, password=password)
+        run_id = secrets.token_hex(4)
+        session_ids = []
+
+        report = []
+        try:
+            if options["url"]:
+                # The cache of an external server cannot be reset: repeated runs and later
+                # levels may be served cached responses
+                self.stdout.write(self.style.WARNING(
+                    f"Testing {options['url']}: its response cache is not cleared between levels."
+                ))
+                for concurrency in levels:
+                    result = self.run_level(
+                        options["url"], username, password, queries, concurrency, total_requests, session_ids
+                    )
+                    report.append({"config": options["url"], "cache_backend": "external", **result})
+                    self.print_result(options["url"], result)
+            else:
+                stub_server = start_stub_llm_server(options["llm_latency"])
+                stub_url = f"http://127.0.0.1:{stub_server.server_address[1]}/v1"
+                self.stdout.write(f"Stub LLM server listening on {stub_url}")
+                cache_backend = settings.CACHES["default"]["BACKEND"].rsplit(".", 1)[-1]
+                self.stdout.write(f"Servers use {cache_backend}, with a fresh key prefix per level")
+                try:
+                    for spec in options["configs"] or DEFAULT_SERVER_CONFIGS:
+                        name, gunicorn_args = parse_server_config(spec)
+                        base_url = f"http://127.0.0.1:{options['port']}"
+                        for concurrency in levels:
+                            # Each level gets a fresh server with its own cache key prefix, so it never
+                            # measures responses cached by an earlier level, configuration or run
+                            cache_prefix = f"loadtest-{run_id}-{name}-{concurrency}"
+                            process = self.start_server(gunicorn_args, options["port"], stub_url, cache_prefix)
+                            try:
+                                self.wait_for_server(process, base_url, options["startup_timeout"])
+                                result = self.run_level(
+                                    base_url, username, password, queries, concurrency, total_requests, session_ids
+                                )
+                            finally:
+                                self.stop_server(process)
+                            report.append({"config": name, "cache_backend": cache_backend, **result})
+                            self.print_result(name, result)
+                finally:
+                    stub_server.shutdown()
+        finally:
+            user.delete()
+            self.delete_sessions(session_ids)
+
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Report written to {options['output']}")
+        self.stdout.write(self.style.SUCCESS("Load test done!"))
+
+    def start_server(self, gunicorn_args, port, stub_url, cache_prefix):
+        """Start gunicorn with the given arguments, pointed at the stub LLM server and a cache namespace."""
+        env = dict(os.environ, OPENAI_BASE_URL=stub_url, CACHE_KEY_PREFIX=cache_prefix)
+        command = [
+            sys.executable, "-m", "gunicorn", *gunicorn_args, f"--config={GUNICORN_CONFIG}",
+            f"--bind=127.0.0.1:{port}", "--log-level=warning",
+        ]
+        self.stdout.write(f"Starting: {' '.join(command[2:])}")
+        return subprocess.Popen(command, cwd=settings.BASE_DIR, env=env)
+
+    def wait_for_server(self, process, base_url, timeout):
+        """Block until the server answers HTTP requests."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError("Server exited during startup.")
+            try:
+                urllib.request.urlopen(f"{base_url}/accounts/login/", timeout=2).read()
+                return
+            except (urllib.error.URLError, OSError):
+                time.sleep(0.5)
+        raise CommandError("Server did not start in time.")
+
+    def stop_server(self, process):
+        """Stop gunicorn gracefully, killing it if it does not exit."""
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    def delete_sessions(self, session_ids):
+        """Delete the chat sessions (and their messages) created by the replayed queries."""
+        deleted = 0
+        for start in range(0, len(session_ids), CLEANUP_BATCH_SIZE):
+            deleted += ChatSession.objects.filter(id__in=session_ids[start:start + CLEANUP_BATCH_SIZE]).delete()[0]
+        self.stdout.write(f"Deleted {deleted} load-test chat sessions and messages")
+
+    def run_level(self, base_url, username, password, queries, concurrency, total_requests, session_ids):
+        """
+        Replay total_requests queries with the given number of concurrent clients.
+
+        The ids of the chat sessions the queries create are appended to session_ids.
+        """
+        clients = [LoadTestClient(base_url, username, password) for _ in range(concurrency)]
+        next_index = iter(range(total_requests))
+        index_lock = threading.Lock()
+        latencies = []
+        statuses = {}
+        results_lock = threading.Lock()
+
+        def worker(client):
+            while True:
+                with index_lock:
+                    index = next(next_index, None)
+                if index is None:
+                    return
+                started = time.perf_counter()
+                status = client.query(queries[index % len(queries)])
+                elapsed = time.perf_counter() - started
+                with results_lock:
+                    latencies.append(elapsed)
+                    statuses[status] = statuses.get(status, 0) + 1
+
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(worker, clients))
+        finally:
+            session_ids.extend(session_id for client in clients for session_id in client.session_ids)
+        duration = time.perf_counter() - started
+
+        latencies.sort()
+        errors = sum(count for status, count in statuses.items() if not 200 <= status < 300)
+        return {
+            "concurrency": concurrency,
+            "requests": len(latencies),
+            "duration": duration,
+            "throughput": len(latencies) / duration if duration else 0.0,
+            "latency_mean": statistics.mean(latencies) if latencies else 0.0,
+            "latency_p50": percentile(latencies, 50),
+            "latency_p95": percentile(latencies, 95),
+            "latency_p99": percentile(latencies, 99),
+            "errors": errors,
+            "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        }
+
+    def print_result(self, name, result):
+        self.stdout.write(
+            f"{name:<16} c={result['concurrency']:<4} {result['throughput']:8.1f} req/s  "
+            f"mean={result['latency_mean'] * 1000:7.1f}ms  p50={result['latency_p50'] * 1000:7.1f}ms  "
+            f"p95={result['latency_p95'] * 1000:7.1f}ms  p99={result['latency_p99'] * 1000:7.1f}ms  "
+            f"errors={result['errors']}/{result['requests']}"
+        )
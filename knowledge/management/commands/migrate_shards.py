@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Apply migrations to every document shard database"
+
+    def handle(self, *args, **kwargs):
+        for shard in settings.DOCUMENT_SHARDS:
+            if shard == "default":
+                continue
+            self.stdout.write(f"Migrating {shard} ({settings.DATABASES[shard]['NAME']})...")
+            call_command("migrate", database=shard, interactive=False, verbosity=kwargs.get("verbosity", 1))
+        print("🎯 Shard Migrations Done!")
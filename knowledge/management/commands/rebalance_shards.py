@@ -0,0 +1,115 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from knowledge.centroids import rebuild_centroids
+from knowledge.embeddings import get_embedding_read_state, invalidate_embedding_read_state
+from knowledge.management.commands.ingest_code import DOCUMENT_UPDATE_FIELDS
+from knowledge.models import CodeCentroid, Document
+from knowledge.shards import get_document_databases, get_document_shards, shard_for_chunk
+
+
+REBALANCE_BATCH_SIZE = 500
+
+
+def register_source_database(index, name):
+    """
+    Configure a connection to a database that is no longer a document shard.
+
+    Args:
+        index (int): Position of the database among the extra sources.
+        name (str): The database name, on the server of the default database.
+
+    Returns:
+        str: The connection alias.
+    """
+    alias = f"rebalance_source_{index}"
+    connections.databases[alias] = {**settings.DATABASES["default"], "NAME": name}
+    return alias
+
+
+def move_misplaced_documents(source, batch_size=REBALANCE_BATCH_SIZE, dry_run=False):
+    """
+    Move the documents of one database that belong on another shard.
+
+    Each batch is upserted on its target shard before it is deleted from the
+    source, so an interrupted run can be repeated without losing documents.
+
+    Args:
+        source (str): The database alias to scan.
+        batch_size (int, optional): Documents read per batch. Defaults to REBALANCE_BATCH_SIZE.
+        dry_run (bool, optional): Only count the documents to move. Defaults to False.
+
+    Returns:
+        dict: The number of documents moved (or to move) per target shard.
+    """
+    moved = {}
+    last_id = None
+    while True:
+        batch = Document.objects.using(source).order_by("id")
+        if last_id is not None:
+            batch = batch.filter(id__gt=last_id)
+        batch = list(batch[:batch_size])
+        if not batch:
+            return moved
+        last_id = batch[-1].id
+
+        documents_by_shard = {}
+        for document in batch:
+            shard = shard_for_chunk(document.chunk_id)
+            if shard != source:
+                documents_by_shard.setdefault(shard, []).append(document)
+        for shard, documents in documents_by_shard.items():
+            moved[shard] = moved.get(shard, 0) + len(documents)
+            if dry_run:
+                continue
+            Document.objects.using(shard).bulk_create(
+                documents, update_conflicts=True, unique_fields=["chunk_id"], update_fields=DOCUMENT_UPDATE_FIELDS
+            )
+            with transaction.atomic(using=source):
+                Document.objects.using(source).filter(id__in=[document.id for document in documents]).delete()
+
+
+class Command(BaseCommand):
+    help = (
+        "Move every document to the shard its chunk_id maps to after DOCUMENT_SHARD_DATABASES changed, "
+        "including documents still in the default database, then rebuild the centroids"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--from-database", action="append", default=[], dest="from_databases",
+            help="Name of a database removed from DOCUMENT_SHARD_DATABASES to drain (repeatable)",
+        )
+        parser.add_argument("--batch-size", type=int, default=REBALANCE_BATCH_SIZE, help="Documents read per batch")
+        parser.add_argument("--dry-run", action="store_true", help="Only report how many documents would move")
+
+    def handle(self, *args, **options):
+        shards = get_document_shards()
+        sources = get_document_databases() + [
+            register_source_database(index, name) for index, name in enumerate(options["from_databases"])
+        ]
+
+        total = 0
+        for source in sources:
+            moved = move_misplaced_documents(source, options["batch_size"], options["dry_run"])
+            for shard, count in sorted(moved.items()):
+                self.stdout.write(f"{source} -> {shard}: {count} documents")
+            total += sum(moved.values())
+
+        if options["dry_run"]:
+            print(f"🔍 {total} Documents Would Move")
+            return
+
+        # Centroids are averaged per database, so every shard's are rebuilt
+        # and the drained databases' are dropped
+        invalidate_embedding_read_state()
+        read_state = get_embedding_read_state()
+        centroid_count = sum(
+            rebuild_centroids(read_state["column"], read_state["model"], using=shard) for shard in shards
+        )
+        for source in sources:
+            if source not in shards:
+                CodeCentroid.objects.using(source).all().delete()
+        print(f"✅ {centroid_count} File/Class Centroids Computed")
+        print(f"🎯 {total} Documents Rebalanced!")
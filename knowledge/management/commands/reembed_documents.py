@@ -0,0 +1,220 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.utils.timezone import now
+
+from knowledge.centroids import rebuild_centroids
+from knowledge.embeddings import (
+    embed_texts,
+    get_active_migration,
+    get_primary_embedding_model,
+    invalidate_embedding_read_state,
+    READ_STATE_CACHE_TIMEOUT,
+)
+from knowledge.models import CodeCentroid, Document, EmbeddingMigration
+from knowledge.shards import get_document_shards
+
+
+def embedding_coverage(target_model):
+    """Return the fraction of embedded documents, on all shards, that have an embedding by target_model."""
+    total = covered = 0
+    for shard in get_document_shards():
+        with connections[shard].cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT COUNT(*), COUNT(*) FILTER (WHERE embedding_next IS NOT NULL AND embedding_next_model = %s)
+                FROM document
+                WHERE embedding IS NOT NULL;
+                """,
+                [target_model]
+            )
+            shard_total, shard_covered = cursor.fetchone()
+        total += shard_total
+        covered += shard_covered
+    return covered / total if total else 1.0
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-embed all documents with a new embedding model in throttled, checkpointed "
+        "batches while searches keep reading the current embeddings, then cut over."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("target_model", nargs="?", help="Model to migrate to. Omit to resume the active migration.")
+        parser.add_argument("--batch-size", type=int, default=100, help="Documents embedded per request.")
+        parser.add_argument("--sleep", type=float, default=1.0, help="Seconds to pause between batches.")
+        parser.add_argument("--max-batches", type=int, default=0, help="Stop after this many batches (0: no limit).")
+        parser.add_argument(
+            "--threshold", type=float, default=None,
+            help="Coverage of new embeddings at which searches cut over (default 0.99).",
+        )
+        parser.add_argument(
+            "--finalize", action="store_true",
+            help="After cut-over, copy the new embeddings into the primary column and complete the migration.",
+        )
+        parser.add_argument("--status", action="store_true", help="Show the progress of the active migration.")
+
+    def handle(self, *args, **options):
+        migration = get_active_migration()
+
+        if options["status"]:
+            if migration is None:
+                self.stdout.write(f"No active migration; documents are embedded with {get_primary_embedding_model()}.")
+            else:
+                self.stdout.write(
+                    f"{migration}: {migration.processed_count} processed, "
+                    f"coverage {embedding_coverage(migration.target_model):.2%}"
+                )
+            return
+
+        target_model = options["target_model"]
+        if migration is None:
+            if not target_model:
+                raise CommandError("No active migration to resume; pass the target model.")
+            source_model = get_primary_embedding_model()
+            if target_model == source_model:
+                raise CommandError(f"Documents are already embedded with {target_model}.")
+            migration = EmbeddingMigration.objects.create(
+                source_model=source_model,
+                target_model=target_model,
+                cutover_threshold=options["threshold"] if options["threshold"] is not None else 0.99,
+            )
+            self.stdout.write(f"Started migration {migration}")
+        elif target_model and target_model != migration.target_model:
+            raise CommandError(f"Migration {migration} is in progress; finish it before starting another.")
+        else:
+            if options["threshold"] is not None:
+                migration.cutover_threshold = options["threshold"]
+                migration.save(update_fields=["cutover_threshold", "updated_at"])
+            self.stdout.write(f"Resuming migration {migration} after {migration.processed_count} documents")
+
+        if options["finalize"]:
+            self.finalize(migration, options["batch_size"], options["sleep"])
+            return
+
+        self.backfill(migration, options["batch_size"], options["sleep"], options["max_batches"])
+
+    def backfill(self, migration, batch_size, sleep, max_batches):
+        """Embed documents with the target model in batches, checkpointing after each one."""
+        # Coverage is only measured once the checkpoint could plausibly reach the threshold
+        shards = get_document_shards()
+        total = sum(Document.objects.using(shard).filter(embedding__isnull=False).count() for shard in shards)
+        batches = 0
+        while not max_batches or batches < max_batches:
+            # Merge the next ids of every shard so a single id checkpoint covers all shards
+            candidates = []
+            for shard in shards:
+                documents = Document.objects.using(shard).filter(embedding__isnull=False).order_by("id")
+                if migration.last_document_id:
+                    documents = documents.filter(id__gt=migration.last_document_id)
+                for doc in documents.only("id", "content", "docstring", "embedding_next_model")[:batch_size]:
+                    candidates.append((doc.id, shard, doc))
+            batch = sorted(candidates, key=lambda candidate: candidate[0])[:batch_size]
+            if not batch:
+                break
+
+            # Rows already written by ingestion during the migration are skipped
+            pending = [(shard, doc) for _, shard, doc in batch if doc.embedding_next_model != migration.target_model]
+            if pending:
+                embeddings = embed_texts(
+                    [doc.content + " " + (doc.docstring or "") for _, doc in pending], migration.target_model
+                )
+                for (_, doc), embedding in zip(pending, embeddings):
+                    doc.embedding_next = embedding
+                    doc.embedding_next_model = migration.target_model
+
+            # Shard writes land before the checkpoint moves past them
+            for shard in shards:
+                shard_documents = [doc for doc_shard, doc in pending if doc_shard == shard]
+                if shard_documents:
+                    Document.objects.using(shard).bulk_update(shard_documents, ["embedding_next", "embedding_next_model"])
+            with transaction.atomic():
+                migration.last_document_id = batch[-1][0]
+                migration.processed_count += len(batch)
+                migration.save(update_fields=["last_document_id", "processed_count", "updated_at"])
+
+            batches += 1
+            self.stdout.write(f"✅ {migration.processed_count}/{total} documents processed")
+            if migration.processed_count >= migration.cutover_threshold * total:
+                self.maybe_cut_over(migration)
+            if sleep:
+                time.sleep(sleep)
+
+        self.maybe_cut_over(migration)
+        coverage = embedding_coverage(migration.target_model)
+        self.stdout.write(f"Coverage of {migration.target_model}: {coverage:.2%} ({migration.status})")
+
+    def maybe_cut_over(self, migration):
+        """Switch searches to the new embeddings once coverage reaches the threshold."""
+        if migration.status != "running":
+            return
+        if embedding_coverage(migration.target_model) < migration.cutover_threshold:
+            return
+
+        # Centroids for the new model are ready before any search reads them
+        for shard in get_document_shards():
+            rebuild_centroids("embedding_next", migration.target_model, using=shard)
+        with transaction.atomic():
+            locked = EmbeddingMigration.objects.select_for_update().get(pk=migration.pk)
+            if locked.status == "running":
+                locked.status = "cut_over"
+                locked.cut_over_at = now()
+                locked.save(update_fields=["status", "cut_over_at", "updated_at"])
+            migration.status = locked.status
+            migration.cut_over_at = locked.cut_over_at
+        invalidate_embedding_read_state()
+        self.stdout.write(self.style.SUCCESS(f"🎯 Searches now use {migration.target_model} embeddings"))
+
+    def finalize(self, migration, batch_size, sleep):
+        """Copy the new embeddings into the primary column and mark the migration completed."""
+        if migration.status != "cut_over":
+            raise CommandError("The migration has not cut over yet; run the backfill first.")
+        if embedding_coverage(migration.target_model) < 1.0:
+            raise CommandError("Some documents lack new embeddings; run the backfill to completion first.")
+
+        # Searches keep reading embedding_next until the migration is completed
+        self.update_in_batches(
+            """
+            UPDATE document SET embedding = embedding_next, embedding_model = embedding_next_model
+            WHERE id IN (
+                SELECT id FROM document
+                WHERE embedding_next IS NOT NULL AND embedding_model <> embedding_next_model
+                LIMIT %s
+            );
+            """,
+            batch_size, sleep, "embeddings copied",
+        )
+
+        with transaction.atomic():
+            migration.status = "completed"
+            migration.save(update_fields=["status", "updated_at"])
+        invalidate_embedding_read_state()
+
+        # Searches read the primary column again once their cached read state expires;
+        # then free the migration column and old centroids
+        time.sleep(READ_STATE_CACHE_TIMEOUT)
+        self.update_in_batches(
+            """
+            UPDATE document SET embedding_next = NULL, embedding_next_model = ''
+            WHERE id IN (SELECT id FROM document WHERE embedding_next IS NOT NULL LIMIT %s);
+            """,
+            batch_size, sleep, "migration embeddings cleared",
+        )
+        for shard in get_document_shards():
+            CodeCentroid.objects.using(shard).filter(embedding_model=migration.source_model).delete()
+        self.stdout.write(self.style.SUCCESS(f"🎯 Migration to {migration.target_model} completed"))
+
+    def update_in_batches(self, sql, batch_size, sleep, label):
+        """Run a batched UPDATE statement on every shard until it no longer changes any row."""
+        for shard in get_document_shards():
+            while True:
+                with connections[shard].cursor() as cursor:
+                    cursor.execute(sql, [batch_size])
+                    updated = cursor.rowcount
+                if not updated:
+                    break
+                self.stdout.write(f"✅ {updated} {label} ({shard})")
+                if sleep:
+                    time.sleep(sleep)
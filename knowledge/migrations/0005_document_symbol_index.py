@@ -0,0 +1,48 @@
+# Generated by Django 4.2.16 on 2026-10-19 09:12
+
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0004_document_docstring_document_file_path_and_more'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='document',
+            name='kind',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='start_line',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='end_line',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='identifier_tokens',
+            field=models.CharField(blank=True, default='', max_length=500),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['title'], name='document_title_d37b4c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=GinIndex(fields=['title'], name='document_title_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=GinIndex(fields=['identifier_tokens'], name='document_ident_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.16 on 2026-10-19 10:03
+
+from django.db import migrations, models
+import knowledge.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0005_document_symbol_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='parent_class',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.CreateModel(
+            name='CodeCentroid',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('file', 'File'), ('class', 'Class')], max_length=10)),
+                ('file_path', models.CharField(max_length=500)),
+                ('name', models.CharField(blank=True, default='', max_length=255)),
+                ('embedding', knowledge.models.VectorField(dimensions=1536)),
+                ('member_count', models.PositiveIntegerField()),
+            ],
+            options={
+                'db_table': 'code_centroid',
+                'indexes': [models.Index(fields=['scope'], name='code_centro_scope_620d77_idx')],
+            },
+        ),
+    ]
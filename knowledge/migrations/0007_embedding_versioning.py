@@ -0,0 +1,60 @@
+# Generated by Django 4.2.16 on 2026-10-19 11:21
+
+from django.db import migrations, models
+import knowledge.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0006_document_parent_class_codecentroid'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='embedding_model',
+            field=models.CharField(default='text-embedding-ada-002', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='embedding_next',
+            field=knowledge.models.VectorField(blank=True, dimensions=1536, null=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='embedding_next_model',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='codecentroid',
+            name='embedding_model',
+            field=models.CharField(default='text-embedding-ada-002', max_length=100),
+        ),
+        migrations.RemoveIndex(
+            model_name='codecentroid',
+            name='code_centro_scope_620d77_idx',
+        ),
+        migrations.AddIndex(
+            model_name='codecentroid',
+            index=models.Index(fields=['scope', 'embedding_model'], name='code_centro_scope_58d2af_idx'),
+        ),
+        migrations.CreateModel(
+            name='EmbeddingMigration',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_model', models.CharField(max_length=100)),
+                ('target_model', models.CharField(max_length=100)),
+                ('status', models.CharField(choices=[('running', 'Running'), ('cut_over', 'Cut over'), ('completed', 'Completed')], default='running', max_length=10)),
+                ('last_document_id', models.UUIDField(blank=True, null=True)),
+                ('processed_count', models.PositiveIntegerField(default=0)),
+                ('cutover_threshold', models.FloatField(default=0.99)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('cut_over_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'embedding_migration',
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.16 on 2026-10-19 15:40
+
+import re
+
+from django.db import migrations
+
+
+BATCH_SIZE = 1000
+
+# A copy of knowledge.symbols.identifier_tokens as of this migration, so later
+# changes to the live code do not change what it does.
+_CAMEL_CASE_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z]|[0-9]|$)|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+
+
+def identifier_tokens(name):
+    """Return the space-separated lowercase words of an identifier."""
+    words = []
+    for part in re.split(r"[_\W]+", name):
+        words.extend(word.lower() for word in _CAMEL_CASE_RE.findall(part))
+    return " ".join(words)
+
+
+def backfill_identifier_tokens(apps, schema_editor):
+    """Fill the identifier index of documents ingested before it existed."""
+    Document = apps.get_model("knowledge", "Document")
+    documents = Document.objects.using(schema_editor.connection.alias).filter(identifier_tokens="").order_by("id")
+    last_id = None
+    while True:
+        batch = documents.filter(id__gt=last_id) if last_id else documents
+        batch = list(batch.only("id", "title")[:BATCH_SIZE])
+        if not batch:
+            break
+        for doc in batch:
+            doc.identifier_tokens = identifier_tokens(doc.title)[:500]
+        Document.objects.using(schema_editor.connection.alias).bulk_update(batch, ["identifier_tokens"])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0007_embedding_versioning'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            backfill_identifier_tokens, migrations.RunPython.noop, hints={"model_name": "document"}
+        ),
+    ]
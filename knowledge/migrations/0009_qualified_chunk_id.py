@@ -0,0 +1,49 @@
+# Generated by Django 4.2.16 on 2026-10-19 17:05
+
+from django.db import migrations, models
+
+
+BATCH_SIZE = 1000
+
+
+def qualify_chunk_ids(apps, schema_editor):
+    """
+    Rewrite "<file name>-<name>" chunk ids as "<file path>:<Class.name>".
+
+    The old ids collided for methods of the same name in one file; the new
+    ones are what ingest_code now generates, so re-ingesting updates these rows.
+    """
+    Document = apps.get_model("knowledge", "Document")
+    documents = Document.objects.using(schema_editor.connection.alias)
+    seen = set()
+    batch = []
+    for doc in documents.only("id", "title", "file_path", "parent_class", "start_line").order_by(
+        "file_path", "start_line", "id"
+    ).iterator(chunk_size=BATCH_SIZE):
+        qualified_name = f"{doc.parent_class}.{doc.title}" if doc.parent_class else doc.title
+        chunk_id = f"{doc.file_path}:{qualified_name}"
+        if chunk_id in seen:
+            chunk_id = f"{chunk_id}@{doc.start_line}"
+        seen.add(chunk_id)
+        doc.chunk_id = chunk_id
+        batch.append(doc)
+        if len(batch) >= BATCH_SIZE:
+            documents.bulk_update(batch, ["chunk_id"])
+            batch = []
+    documents.bulk_update(batch, ["chunk_id"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0008_backfill_identifier_tokens'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='document',
+            name='chunk_id',
+            field=models.CharField(max_length=800, unique=True),
+        ),
+        migrations.RunPython(qualify_chunk_ids, migrations.RunPython.noop, hints={"model_name": "document"}),
+    ]
@@ -1,3 +1,4 @@
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
 import uuid
 
@@ -26,8 +27,16 @@ class Document(models.Model):
     file_path = models.CharField(max_length=500)  # Path to the source file
     created_at = models.DateTimeField(auto_now_add=True)
     embedding = VectorField(dimensions=1536, null=True, blank=True)  # OpenAI Embedding
-    chunk_id = models.CharField(max_length=255, unique=True)
+    embedding_model = models.CharField(max_length=100, default="text-embedding-ada-002")  # Model behind embedding
+    embedding_next = VectorField(dimensions=1536, null=True, blank=True)  # Embedding by a model being migrated to
+    embedding_next_model = models.CharField(max_length=100, blank=True, default="")  # Model behind embedding_next
+    chunk_id = models.CharField(max_length=800, unique=True)  # File path and qualified name
     docstring = models.TextField(null=True, blank=True)  # Extracted docstring (if available)
+    kind = models.CharField(max_length=20, blank=True, default="")  # "function" or "class"
+    start_line = models.PositiveIntegerField(null=True, blank=True)  # First line of the definition
+    end_line = models.PositiveIntegerField(null=True, blank=True)  # Last line of the definition
+    identifier_tokens = models.CharField(max_length=500, blank=True, default="")  # Split name words for symbol lookup
+    parent_class = models.CharField(max_length=255, blank=True, default="")  # Enclosing class of a method
 
     def __str__(self):
         return self.title
@@ -37,11 +46,64 @@ class Document(models.Model):
         indexes = [
             models.Index(fields=["chunk_id"]),  # Use B-tree for chunk_id
             models.Index(fields=["file_path"]),  # B-tree for file_path
+            models.Index(fields=["title"]),  # B-tree for exact symbol lookup
+            GinIndex(fields=["title"], name="document_title_trgm_idx", opclasses=["gin_trgm_ops"]),
+            GinIndex(fields=["identifier_tokens"], name="document_ident_trgm_idx", opclasses=["gin_trgm_ops"]),
         ]
 
         db_table = 'document'
 
 
+class CodeCentroid(models.Model):
+    """Mean embedding of the documents in a file or class, used for coarse-to-fine retrieval."""
+    SCOPE_CHOICES = (("file", "File"), ("class", "Class"))
+
+    scope = models.CharField(max_length=10, choices=SCOPE_CHOICES)
+    file_path = models.CharField(max_length=500)
+    name = models.CharField(max_length=255, blank=True, default="")  # Class name ("" for files)
+    embedding = VectorField(dimensions=1536)
+    embedding_model = models.CharField(max_length=100, default="text-embedding-ada-002")
+    member_count = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f"{self.file_path}:{self.name}" if self.name else self.file_path
+
+    class Meta:
+        """Meta Information."""
+        indexes = [
+            models.Index(fields=["scope", "embedding_model"]),
+        ]
+
+        db_table = 'code_centroid'
+
+
+class EmbeddingMigration(models.Model):
+    """Progress of an online re-embedding of all documents with a new model."""
+    STATUS_CHOICES = (
+        ("running", "Running"),  # Backfilling embedding_next; reads use embedding
+        ("cut_over", "Cut over"),  # Reads use embedding_next
+        ("completed", "Completed"),  # embedding_next copied into embedding; reads use embedding
+    )
+
+    source_model = models.CharField(max_length=100)
+    target_model = models.CharField(max_length=100)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="running")
+    last_document_id = models.UUIDField(null=True, blank=True)  # Checkpoint of the backfill
+    processed_count = models.PositiveIntegerField(default=0)
+    cutover_threshold = models.FloatField(default=0.99)  # Coverage of embedding_next required to cut over
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    cut_over_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.source_model} -> {self.target_model} ({self.status})"
+
+    class Meta:
+        """Meta Information."""
+
+        db_table = 'embedding_migration'
+
+
 class ChatSession(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
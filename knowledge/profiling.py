@@ -0,0 +1,213 @@
+import cProfile
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from knowledge.shards import get_document_shards, sequential_shard_queries
+
+
+PROFILE_HEADER = "HTTP_X_PROFILE"
+PROFILE_PARAM = "profile"
+PROFILE_MODES = {"sample", "cprofile"}
+SAMPLE_INTERVAL = 0.005
+
+# Statements worth an EXPLAIN ANALYZE: vector distance and trigram similarity searches.
+EXPLAIN_MARKERS = ("<=>", "similarity(", "SIMILARITY(")
+
+
+def requested_profile_mode(request):
+    """
+    Return the profiling mode requested by a staff user, or None.
+
+    Profiling is requested with an "X-Profile" header or a "profile" query
+    parameter whose value is "sample" (the default) or "cprofile".
+
+    Args:
+        request (HttpRequest): The incoming request.
+
+    Returns:
+        str: The profiling mode, or None if the request is not profiled.
+    """
+    value = request.META.get(PROFILE_HEADER) or request.GET.get(PROFILE_PARAM)
+    if not value:
+        return None
+    user = getattr(request, "user", None)
+    if user is None or not user.is_staff:
+        return None
+    value = value.lower()
+    return value if value in PROFILE_MODES else "sample"
+
+
+class StackSampler:
+    """Samples the call stack of one thread at a fixed interval into collapsed stacks."""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def collapsed(self):
+        """Return the samples in the collapsed-stack format read by flamegraph.pl and speedscope."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class QueryRecorder:
+    """Database execute wrapper recording every SQL statement with its duration."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                "using": context["connection"].alias,
+                "sql": sql,
+                "params": params,
+                "many": many,
+                "duration_ms": (time.perf_counter() - started) * 1000,
+            })
+
+
+def explain_analyze(queries):
+    """Run EXPLAIN ANALYZE for the recorded vector and trigram search statements."""
+    plans = []
+    for query in queries:
+        sql = query["sql"].strip()
+        if query["many"] or not sql.upper().startswith(("SELECT", "WITH")):
+            continue
+        if not any(marker in sql for marker in EXPLAIN_MARKERS):
+            continue
+        try:
+            with connections[query["using"]].cursor() as cursor:
+                cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql.rstrip(';')}", query["params"])
+                plans.append({"using": query["using"], "sql": sql, "plan": cursor.fetchone()[0]})
+        except Exception as e:
+            plans.append({"using": query["using"], "sql": sql, "error": str(e)})
+    return plans
+
+
+def _json_safe(value):
+    """Convert SQL parameters to something JSON can store."""
+    if isinstance(value, (list, tuple)):
+        return [_json_safe(item) for item in value]
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value if not isinstance(value, str) or len(value) <= 200 else value[:200] + "..."
+    return str(value)
+
+
+def run_profiled(mode, request, view, args, kwargs):
+    """Run a view under the profiler and save its profile and JSON report."""
+    profile_dir = settings.PROFILE_DIR
+    os.makedirs(profile_dir, exist_ok=True)
+    profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+    recorder = QueryRecorder()
+    profiler = cProfile.Profile() if mode == "cprofile" else None
+    sampler = StackSampler(threading.get_ident()) if mode == "sample" else None
+
+    started = time.perf_counter()
+    with ExitStack() as stack:
+        # Shard queries run on this thread so the wrappers and the profiler see them
+        stack.enter_context(sequential_shard_queries())
+        for alias in {"default", *get_document_shards()}:
+            stack.enter_context(connections[alias].execute_wrapper(recorder))
+        if profiler:
+            profiler.enable()
+        else:
+            sampler.start()
+        try:
+            response = view(request, *args, **kwargs)
+            # Include template and serializer rendering in the profile
+            if hasattr(response, "render") and not getattr(response, "is_rendered", True):
+                response.render()
+        finally:
+            if profiler:
+                profiler.disable()
+            else:
+                sampler.stop()
+    duration = time.perf_counter() - started
+
+    if profiler:
+        profile_file = f"{profile_id}.prof"
+        profiler.dump_stats(os.path.join(profile_dir, profile_file))
+    else:
+        profile_file = f"{profile_id}.collapsed"
+        with open(os.path.join(profile_dir, profile_file), "w", encoding="utf-8") as f:
+            f.write(sampler.collapsed())
+
+    report = {
+        "id": profile_id,
+        "method": request.method,
+        "path": request.path,
+        "user": request.user.get_username(),
+        "mode": mode,
+        "status": response.status_code,
+        "duration_ms": duration * 1000,
+        "profile_file": profile_file,
+        "sql_count": len(recorder.queries),
+        "sql_duration_ms": sum(query["duration_ms"] for query in recorder.queries),
+        "sql": [{**query, "params": _json_safe(query["params"])} for query in recorder.queries],
+        "explain": explain_analyze(recorder.queries),
+    }
+    with open(os.path.join(profile_dir, f"{profile_id}.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, default=str)
+
+    response["X-Profile-Id"] = profile_id
+    return response
+
+
+def profile_request(view):
+    """
+    Profile a view when a staff user asks for it with "X-Profile" or "?profile=".
+
+    The profiled request runs under a stack sampler (or cProfile), records its
+    SQL statements with timings and EXPLAIN ANALYZE plans of the vector and
+    trigram searches, and saves a flamegraph-compatible profile and a JSON
+    report to settings.PROFILE_DIR. Other requests call the view directly.
+
+    Args:
+        view (callable): The view function or method to wrap.
+
+    Returns:
+        callable: The wrapped view.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        mode = requested_profile_mode(request)
+        if mode is None:
+            return view(request, *args, **kwargs)
+        return run_profiled(mode, request, view, args, kwargs)
+
+    return wrapper
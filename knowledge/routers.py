@@ -0,0 +1,23 @@
+from django.conf import settings
+
+
+# Models stored on document shards; everything else stays in the default database.
+SHARDED_MODELS = {"document", "codecentroid"}
+
+
+class DocumentShardRouter:
+    """
+    Database router for document shards.
+
+    Shard databases only get the document and centroid tables. Reads and writes
+    are not routed here: the shard of a document depends on its chunk_id, so
+    callers choose it explicitly with .using() (see knowledge.shards).
+    """
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == "default" or db not in settings.DOCUMENT_SHARDS:
+            return None
+        if app_label != "knowledge":
+            return False
+        # Operations without a model (e.g. creating the pg_trgm extension) run on shards too
+        return model_name is None or model_name in SHARDED_MODELS
@@ -0,0 +1,129 @@
+import logging
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+_local = threading.local()
+
+
+def get_document_shards():
+    """
+    Return the database aliases holding Document rows.
+
+    Returns:
+        list: The shard aliases, or ["default"] when sharding is not configured.
+    """
+    return settings.DOCUMENT_SHARDS
+
+
+def get_document_databases():
+    """
+    Return every configured database alias that may hold Document rows.
+
+    Besides the current shards this includes the default database once sharding
+    is enabled, since documents ingested before that still live there.
+
+    Returns:
+        list: The database aliases, shards first.
+    """
+    shards = get_document_shards()
+    return shards if "default" in shards else [*shards, "default"]
+
+
+def shard_for_chunk(chunk_id):
+    """
+    Return the shard a document is stored on, from a stable hash of its chunk_id.
+
+    Args:
+        chunk_id (str): The document chunk_id.
+
+    Returns:
+        str: The database alias of the shard.
+    """
+    shards = get_document_shards()
+    return shards[zlib.crc32(chunk_id.encode("utf-8")) % len(shards)]
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=len(get_document_shards()) * settings.SHARD_QUERY_THREADS_PER_SHARD,
+                thread_name_prefix="shard-query",
+            )
+    return _executor
+
+
+def _timed_call(func, alias, args, kwargs, release_connection):
+    started = time.perf_counter()
+    try:
+        return func(alias, *args, **kwargs), time.perf_counter() - started
+    finally:
+        if release_connection:
+            # Worker threads are not covered by Django's per-request connection cleanup;
+            # their connections are reused until broken or older than CONN_MAX_AGE
+            connections[alias].close_if_unusable_or_obsolete()
+
+
+@contextmanager
+def sequential_shard_queries():
+    """
+    Run shard queries on the calling thread while the context is active.
+
+    Used by request profiling so every shard query is seen by the profiler
+    and by the database execute wrappers of the request thread.
+    """
+    previous = getattr(_local, "sequential", False)
+    _local.sequential = True
+    try:
+        yield
+    finally:
+        _local.sequential = previous
+
+
+def scatter(func, *args, shards=None, **kwargs):
+    """
+    Call func(alias, *args, **kwargs) on every shard concurrently.
+
+    With a single shard the call runs inline on the calling thread, so
+    unsharded deployments do not pay for the thread pool.
+
+    Args:
+        func (callable): The per-shard function; its first argument is the database alias.
+        shards (list, optional): The aliases to query. Defaults to all document shards.
+
+    Returns:
+        list: One (alias, result, latency in seconds) tuple per shard, in shard order.
+    """
+    shards = shards or get_document_shards()
+    if len(shards) == 1 or getattr(_local, "sequential", False):
+        return [
+            (alias, *_timed_call(func, alias, args, kwargs, release_connection=False))
+            for alias in shards
+        ]
+
+    executor = _get_executor()
+    futures = [
+        (alias, executor.submit(_timed_call, func, alias, args, kwargs, True))
+        for alias in shards
+    ]
+    results = []
+    for alias, future in futures:
+        result, latency = future.result()
+        results.append((alias, result, latency))
+    logger.debug(
+        "%s shard latencies: %s", getattr(func, "__name__", func),
+        ", ".join(f"{alias}={latency * 1000:.1f}ms" for alias, _, latency in results),
+    )
+    return results
@@ -0,0 +1,141 @@
+import hashlib
+import threading
+import time
+
+from django.core.cache import cache
+
+
+# Single-flight settings: how long followers wait for a leader, and how often
+# followers in other workers poll the shared cache for the leader's result.
+SINGLE_FLIGHT_TIMEOUT = 30
+SINGLE_FLIGHT_POLL_INTERVAL = 0.05
+SINGLE_FLIGHT_SAVED_CALLS_KEY = "single_flight_saved_calls"
+
+
+class _InflightCall:
+    """A call in progress in this process, shared by the threads waiting on it."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_inflight_calls = {}
+_inflight_lock = threading.Lock()
+
+
+def query_cache_key(query):
+    """
+    Build a cache key for a preprocessed query that is stable across processes.
+
+    The words are sorted first, so the key does not depend on the order in
+    which they came out of a set (which varies with the hash seed).
+
+    Args:
+        query (str): The preprocessed query.
+
+    Returns:
+        str: The cache key for the query response.
+    """
+    normalized = " ".join(sorted(query.split()))
+    digest = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+    return f"query_response_{digest}"
+
+
+def _record_saved_call():
+    """Increment the counter of upstream calls avoided by coalescing."""
+    cache.add(SINGLE_FLIGHT_SAVED_CALLS_KEY, 0, timeout=None)
+    try:
+        cache.incr(SINGLE_FLIGHT_SAVED_CALLS_KEY)
+    except ValueError:
+        # The key was evicted between add() and incr().
+        cache.set(SINGLE_FLIGHT_SAVED_CALLS_KEY, 1, timeout=None)
+
+
+def get_single_flight_saved_calls():
+    """
+    Return how many upstream calls were saved by single-flight coalescing.
+
+    Returns:
+        int: The number of requests that reused a leader's result.
+    """
+    return cache.get(SINGLE_FLIGHT_SAVED_CALLS_KEY, 0)
+
+
+def _wait_for_cached_result(key, timeout):
+    """Poll the cache until another worker stores the result for key."""
+    lock_key = f"{key}_lock"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = cache.get(key)
+        if result is not None:
+            return result
+        if cache.get(lock_key) is None:
+            # The leader released its lock without storing a result (it failed).
+            return cache.get(key)
+        time.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+    return None
+
+
+def single_flight(key, func, timeout=SINGLE_FLIGHT_TIMEOUT, cache_timeout=3600):
+    """
+    Run func once for concurrent callers sharing the same key.
+
+    The first caller in a process becomes the leader; other threads wait on its
+    result and receive its exception if it fails. Across worker processes a
+    cache lock elects a single leader, and the other workers poll the cache for
+    the stored result; this needs a cache shared by the workers (REDIS_URL).
+    If the leader does not finish within timeout, waiting callers run func
+    themselves, as does the leader of a worker whose remote leader failed.
+
+    Args:
+        key (str): The cache key under which the result is stored.
+        func (callable): Computes the result; it must return a cacheable value.
+        timeout (int, optional): Seconds to wait for a leader. Defaults to SINGLE_FLIGHT_TIMEOUT.
+        cache_timeout (int, optional): Seconds to keep the result cached. Defaults to 3600.
+
+    Returns:
+        object: The result of func, computed by this caller or by the leader.
+    """
+    with _inflight_lock:
+        call = _inflight_calls.get(key)
+        is_leader = call is None
+        if is_leader:
+            call = _InflightCall()
+            _inflight_calls[key] = call
+
+    if not is_leader:
+        if call.done.wait(timeout):
+            if call.error is not None:
+                # Retrying while upstream is failing would only repeat the herd
+                raise call.error
+            _record_saved_call()
+            return call.result
+        return func()
+
+    try:
+        lock_key = f"{key}_lock"
+        has_lock = cache.add(lock_key, True, timeout=timeout)
+        if not has_lock:
+            result = _wait_for_cached_result(key, timeout)
+            if result is not None:
+                _record_saved_call()
+                call.result = result
+                return result
+
+        try:
+            result = func()
+            cache.set(key, result, timeout=cache_timeout)
+        finally:
+            if has_lock:
+                cache.delete(lock_key)
+        call.result = result
+        return result
+    except Exception as e:
+        call.error = e
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight_calls.pop(key, None)
+        call.done.set()
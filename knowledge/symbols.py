@@ -0,0 +1,248 @@
+import re
+from collections import namedtuple
+
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db.models.functions import Lower
+
+from knowledge.models import Document
+from knowledge.shards import scatter
+
+
+# Questions asking where a named symbol lives, e.g. "Where is process_repository?"
+# or "find the class QueryView". Open-ended questions fall through to the RAG pipeline.
+SYMBOL_LOOKUP_PATTERNS = [
+    re.compile(
+        r"^\s*(?:where\s+is|where's|where\s+are|where\s+can\s+i\s+find|find|locate|show\s+me|go\s+to)\s+"
+        r"(?:the\s+)?(?:(?P<kind>function|method|class|def)\s+)?"
+        r"(?P<quote>`)?(?P<symbol>[A-Za-z_][A-Za-z0-9_.]*)`?(?P<call>\(\))?"
+        r"(?:\s+(?:function|method|class|defined|declared|implemented))?\s*\??\s*$",
+        re.IGNORECASE,
+    ),
+    re.compile(
+        r"^\s*(?:in\s+)?which\s+file\s+(?:is|defines|contains|has)\s+(?:the\s+)?(?:(?P<kind>function|method|class)\s+)?"
+        r"(?P<quote>`)?(?P<symbol>[A-Za-z_][A-Za-z0-9_.]*)`?(?P<call>\(\))?"
+        r"(?:\s+(?:defined|declared|implemented))?\s*\??\s*$",
+        re.IGNORECASE,
+    ),
+]
+
+# Words that can follow "where is" without naming a symbol ("where is the bug?").
+NON_SYMBOL_WORDS = {
+    "the", "a", "an", "this", "that", "it", "my", "code", "bug", "error", "function", "class", "method",
+    "logic", "file", "config", "configuration", "everything", "something",
+}
+
+# Extensions of file names, which are not symbols ("where is settings.py?")
+SOURCE_FILE_EXTENSIONS = {
+    "py", "pyi", "pyx", "js", "ts", "html", "css", "json", "yml", "yaml", "toml", "cfg", "ini", "txt", "md", "sh",
+}
+
+SYMBOL_FUZZY_THRESHOLD = 0.4
+SYMBOL_LOOKUP_LIMIT = 5
+SYMBOL_FIELDS = ("title", "kind", "file_path", "start_line", "end_line")
+
+SymbolQuery = namedtuple("SymbolQuery", ["name", "identifier"])
+
+_CAMEL_CASE_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z]|[0-9]|$)|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+
+
+def split_identifier(name):
+    """
+    Split an identifier into lowercase words on snake_case and camelCase boundaries.
+
+    Args:
+        name (str): The identifier, e.g. "parseHTTPResponse_v2".
+
+    Returns:
+        list: The lowercase words, e.g. ["parse", "http", "response", "v", "2"].
+    """
+    words = []
+    for part in re.split(r"[_\W]+", name):
+        words.extend(word.lower() for word in _CAMEL_CASE_RE.findall(part))
+    return words
+
+
+def identifier_tokens(name):
+    """
+    Build the identifier index entry stored on a Document at ingest time.
+
+    Args:
+        name (str): The function or class name.
+
+    Returns:
+        str: The space-separated words of the identifier.
+    """
+    return " ".join(split_identifier(name))
+
+
+def looks_like_identifier(symbol):
+    """
+    Tell whether a word is written like a code identifier rather than plain English.
+
+    Args:
+        symbol (str): The word from the query, e.g. "process_repository" or "settings".
+
+    Returns:
+        bool: True for snake_case, camelCase or dotted names.
+    """
+    return "_" in symbol or "." in symbol or symbol not in (symbol.lower(), symbol.capitalize())
+
+
+def detect_symbol_lookup(query):
+    """
+    Detect a "where is X" question and extract the symbol it asks about.
+
+    Plain words ("where is authentication?") are still returned, but marked so
+    that only an exact name match answers them; otherwise the question goes
+    through the RAG pipeline.
+
+    Args:
+        query (str): The raw user query, before preprocessing.
+
+    Returns:
+        SymbolQuery: The symbol name and whether it is clearly an identifier
+        (fuzzy matching allowed), or None if the query is not a symbol lookup.
+    """
+    for pattern in SYMBOL_LOOKUP_PATTERNS:
+        match = pattern.match(query)
+        if match:
+            name = match.group("symbol")
+            if "." in name and name.rsplit(".", 1)[-1].lower() in SOURCE_FILE_EXTENSIONS:
+                # A question about a file goes through the RAG pipeline
+                return None
+            symbol = name.split(".")[-1]
+            if symbol and symbol.lower() not in NON_SYMBOL_WORDS:
+                identifier = bool(
+                    match.group("kind") or match.group("quote") or match.group("call") or looks_like_identifier(name)
+                )
+                return SymbolQuery(symbol, identifier)
+    return None
+
+
+def _lookup_symbol_shard(using, symbol, limit, fuzzy, exact):
+    """Run the lookup cascade on one shard and return the matching tier with its documents."""
+    documents = Document.objects.using(using).only(*SYMBOL_FIELDS)
+
+    tiers = []
+    if exact:
+        tiers.append(lambda: documents.filter(title=symbol)[:limit])
+        tiers.append(lambda: documents.filter(title__iexact=symbol)[:limit])
+    if not fuzzy:
+        return _first_matching_tier(tiers)
+
+    tiers.append(lambda: documents.filter(title__istartswith=symbol).order_by("title")[:limit])
+    words = split_identifier(symbol)
+    if words:
+        token_matches = documents
+        for word in words:
+            token_matches = token_matches.filter(identifier_tokens__regex=rf"(^| ){re.escape(word)}( |$)")
+        tiers.append(lambda: token_matches.order_by("title")[:limit])
+    tiers.append(
+        lambda: documents.annotate(similarity=TrigramSimilarity("title", symbol))
+        .filter(similarity__gt=SYMBOL_FUZZY_THRESHOLD)
+        .order_by("-similarity")[:limit]
+    )
+
+    return _first_matching_tier(tiers)
+
+
+def _first_matching_tier(tiers):
+    """Run the tier queries in order and return the first tier with matches."""
+    for tier, query in enumerate(tiers):
+        matches = list(query())
+        if matches:
+            return tier, matches
+    return len(tiers), []
+
+
+def _symbol_match(doc):
+    """Convert a matching document to the dictionary returned by symbol lookups."""
+    return {field: getattr(doc, field) for field in SYMBOL_FIELDS}
+
+
+def lookup_symbol(symbol, limit=SYMBOL_LOOKUP_LIMIT, fuzzy=True, exact=True):
+    """
+    Find documents defining a symbol, from the most to the least precise match.
+
+    Tries an exact name match, then a name prefix, then documents whose
+    identifier words contain all the words of the symbol, then trigram
+    similarity on the name. Every shard is searched and only the matches of
+    the most precise tier found on any shard are kept.
+
+    Args:
+        symbol (str): The symbol name from the query.
+        limit (int, optional): The maximum number of matches. Defaults to SYMBOL_LOOKUP_LIMIT.
+        fuzzy (bool, optional): Try the prefix, identifier word and trigram tiers after
+            the exact ones. Defaults to True.
+        exact (bool, optional): Try the exact name tiers; callers that already did so
+            with lookup_symbols_exact pass False. Defaults to True.
+
+    Returns:
+        list: A list of dictionaries with the symbol name, kind, file path and line span.
+    """
+    shard_results = [result for _, result, _ in scatter(_lookup_symbol_shard, symbol, limit, fuzzy, exact)]
+    best_tier = min(tier for tier, _ in shard_results)
+    matches = [doc for tier, docs in shard_results if tier == best_tier for doc in docs][:limit]
+
+    return [_symbol_match(doc) for doc in matches]
+
+
+def _lookup_exact_shard(using, names):
+    """Fetch the documents of one shard whose name matches any of names case-insensitively."""
+    return list(
+        Document.objects.using(using).only(*SYMBOL_FIELDS)
+        .annotate(title_lower=Lower("title")).filter(title_lower__in=names).order_by("title")
+    )
+
+
+def lookup_symbols_exact(symbols, limit=SYMBOL_LOOKUP_LIMIT):
+    """
+    Find the documents named like each of several symbols, with one query per shard.
+
+    This is the exact and case-insensitive tiers of lookup_symbol for a batch:
+    exact-case matches are preferred, then case-insensitive ones.
+
+    Args:
+        symbols (iterable): The symbol names.
+        limit (int, optional): The maximum number of matches per symbol. Defaults to SYMBOL_LOOKUP_LIMIT.
+
+    Returns:
+        dict: The matches of each symbol, as returned by lookup_symbol; empty lists for symbols without matches.
+    """
+    symbols = set(symbols)
+    if not symbols:
+        return {}
+    shard_results = scatter(_lookup_exact_shard, sorted({symbol.lower() for symbol in symbols}))
+    documents = [doc for _, docs, _ in shard_results for doc in docs]
+
+    matches = {}
+    for symbol in symbols:
+        named = [doc for doc in documents if doc.title == symbol]
+        named = named or [doc for doc in documents if doc.title_lower == symbol.lower()]
+        matches[symbol] = [_symbol_match(doc) for doc in named[:limit]]
+    return matches
+
+
+def format_symbol_answer(symbol, matches):
+    """
+    Format symbol matches as a chat answer.
+
+    Args:
+        symbol (str): The symbol name from the query.
+        matches (list): The matches returned by lookup_symbol.
+
+    Returns:
+        str: A human-readable answer listing where the symbol is defined.
+    """
+    def location(match):
+        if match["start_line"]:
+            return f"{match['file_path']} (lines {match['start_line']}-{match['end_line']})"
+        return match["file_path"]
+
+    if len(matches) == 1:
+        match = matches[0]
+        return f"{(match['kind'] or 'symbol').capitalize()} `{match['title']}` is defined in {location(match)}."
+
+    lines = [f"Found {len(matches)} definitions matching `{symbol}`:"]
+    lines.extend(f"- {match['kind'] or 'symbol'} `{match['title']}` in {location(match)}" for match in matches)
+    return "\n".join(lines)
@@ -1,3 +1,426 @@
-from django.test import TestCase
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, override_settings
+
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from knowledge import singleflight
+from knowledge.management.commands.ingest_code import make_chunk_id
+from knowledge.management.commands.loadtest import load_queries, parse_server_config
+from knowledge.shards import get_document_databases, shard_for_chunk
+from knowledge.symbols import SymbolQuery, detect_symbol_lookup, identifier_tokens, split_identifier
+from knowledge.singleflight import get_single_flight_saved_calls, query_cache_key, single_flight
+
+
+LOCMEM_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "knowledge-tests",
+    }
+}
+
+
+class CountingEvent(threading.Event):
+    """Event that counts the threads waiting on it, so tests know when followers are parked."""
+
+    def __init__(self):
+        super().__init__()
+        self.waiters = threading.Semaphore(0)
+
+    def wait(self, timeout=None):
+        self.waiters.release()
+        return super().wait(timeout)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.key = query_cache_key("where is the parser")
+
+    def start_leader(self, func):
+        """Start a leader thread blocked in func and return it with its call's counting event."""
+        outcome = {}
+
+        def run():
+            try:
+                outcome["result"] = single_flight(self.key, func)
+            except Exception as e:
+                outcome["error"] = e
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        while self.key not in singleflight._inflight_calls:
+            pass
+        event = CountingEvent()
+        singleflight._inflight_calls[self.key].done = event
+        return thread, outcome, event
+
+    def start_followers(self, count, func, event, **kwargs):
+        """Start follower threads and return once all of them wait on the leader."""
+        outcomes = [{} for _ in range(count)]
+
+        def run(outcome):
+            try:
+                outcome["result"] = single_flight(self.key, func, **kwargs)
+            except Exception as e:
+                outcome["error"] = e
+
+        threads = [threading.Thread(target=run, args=(outcome,)) for outcome in outcomes]
+        for thread in threads:
+            thread.start()
+        for _ in threads:
+            self.assertTrue(event.waiters.acquire(timeout=5))
+        return threads, outcomes
+
+    def test_query_cache_key_is_stable_across_processes(self):
+        # Preprocessed queries are joined from a set, whose order depends on the hash seed
+        script = (
+            "from knowledge.singleflight import query_cache_key; "
+            "print(query_cache_key(' '.join({'parser', 'search', 'lookup', 'retrieve', 'find', 'function'})))"
+        )
+        keys = {
+            subprocess.run(
+                [sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                env={**os.environ, "PYTHONHASHSEED": str(seed)},
+            ).stdout
+            for seed in range(1, 5)
+        }
+        self.assertEqual(len(keys), 1)
+        self.assertEqual(keys.pop().strip(), query_cache_key("function find lookup parser retrieve search"))
+
+    def test_followers_share_the_leader_result(self):
+        release = threading.Event()
+        calls = []
+
+        def func():
+            calls.append(1)
+            release.wait(5)
+            return {"answer": "42"}
+
+        leader, leader_outcome, event = self.start_leader(func)
+        followers, outcomes = self.start_followers(3, func, event)
+        release.set()
+        for thread in [leader, *followers]:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(leader_outcome, {"result": {"answer": "42"}})
+        self.assertEqual(outcomes, [{"result": {"answer": "42"}}] * 3)
+        self.assertEqual(get_single_flight_saved_calls(), 3)
+        self.assertEqual(cache.get(self.key), {"answer": "42"})
+        self.assertNotIn(self.key, singleflight._inflight_calls)
+
+    def test_leader_error_is_propagated_to_followers(self):
+        release = threading.Event()
+        calls = []
+
+        def func():
+            calls.append(1)
+            release.wait(5)
+            raise RuntimeError("upstream down")
+
+        leader, leader_outcome, event = self.start_leader(func)
+        followers, outcomes = self.start_followers(3, func, event)
+        release.set()
+        for thread in [leader, *followers]:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertIsInstance(leader_outcome["error"], RuntimeError)
+        for outcome in outcomes:
+            self.assertIs(outcome["error"], leader_outcome["error"])
+        self.assertEqual(get_single_flight_saved_calls(), 0)
+        self.assertIsNone(cache.get(f"{self.key}_lock"))
+
+    def test_follower_runs_func_after_timeout(self):
+        release = threading.Event()
+        leader, leader_outcome, event = self.start_leader(lambda: release.wait(5) and "leader")
+        followers, outcomes = self.start_followers(1, lambda: "follower", event, timeout=0.05)
+        followers[0].join(5)
+        release.set()
+        leader.join(5)
+
+        self.assertEqual(outcomes, [{"result": "follower"}])
+        self.assertEqual(leader_outcome, {"result": "leader"})
+
+    def test_waits_for_a_leader_in_another_worker(self):
+        cache.add(f"{self.key}_lock", True)
+        timer = threading.Timer(0.1, lambda: cache.set(self.key, {"answer": "remote"}))
+        timer.start()
+
+        result = single_flight(self.key, lambda: self.fail("the remote leader's result should be reused"))
+        timer.join()
+
+        self.assertEqual(result, {"answer": "remote"})
+        self.assertEqual(get_single_flight_saved_calls(), 1)
+
+    def test_runs_func_when_the_other_worker_fails(self):
+        cache.add(f"{self.key}_lock", True)
+        timer = threading.Timer(0.1, lambda: cache.delete(f"{self.key}_lock"))
+        timer.start()
+
+        result = single_flight(self.key, lambda: {"answer": "local"})
+        timer.join()
+
+        self.assertEqual(result, {"answer": "local"})
+        self.assertEqual(cache.get(self.key), {"answer": "local"})
+        self.assertEqual(get_single_flight_saved_calls(), 0)
+
+
+class SplitIdentifierTests(SimpleTestCase):
+    def test_splits_snake_and_camel_case(self):
+        self.assertEqual(split_identifier("process_repository"), ["process", "repository"])
+        self.assertEqual(split_identifier("QueryView"), ["query", "view"])
+        self.assertEqual(split_identifier("parseHTTPResponse_v2"), ["parse", "http", "response", "v", "2"])
+
+    def test_ignores_leading_underscores_and_dunders(self):
+        self.assertEqual(split_identifier("__init__"), ["init"])
+        self.assertEqual(split_identifier("_timed_call"), ["timed", "call"])
+
+    def test_identifier_tokens_joins_words(self):
+        self.assertEqual(identifier_tokens("getEmbeddingReadState"), "get embedding read state")
+        self.assertEqual(identifier_tokens("___"), "")
+
+
+class MakeChunkIdTests(SimpleTestCase):
+    def test_methods_of_the_same_name_get_distinct_ids(self):
+        self.assertEqual(make_chunk_id("repo/knowledge/views.py", "post", "QueryView"), "repo/knowledge/views.py:QueryView.post")
+        self.assertNotEqual(
+            make_chunk_id("repo/knowledge/views.py", "post", "QueryView"),
+            make_chunk_id("repo/knowledge/views.py", "post", "BatchQueryView"),
+        )
+
+    def test_same_file_name_in_different_directories(self):
+        self.assertNotEqual(make_chunk_id("repo/a/utils.py", "load"), make_chunk_id("repo/b/utils.py", "load"))
+
+
+class DetectSymbolLookupTests(SimpleTestCase):
+    def test_identifiers_allow_fuzzy_matching(self):
+        cases = {
+            "Where is process_repository?": "process_repository",
+            "find the class QueryView": "QueryView",
+            "where is `parse`?": "parse",
+            "where is parse()?": "parse",
+            "which file defines HTTPServer": "HTTPServer",
+            "find the function search": "search",
+            "where is knowledge.utils.search_flat": "search_flat",
+        }
+        for query, symbol in cases.items():
+            with self.subTest(query=query):
+                self.assertEqual(detect_symbol_lookup(query), SymbolQuery(symbol, True))
+
+    def test_plain_words_only_match_exactly(self):
+        for query in [
+            "where is authentication?", "find documentation", "find similar", "show me examples",
+            "locate settings", "Where is Document?",
+        ]:
+            with self.subTest(query=query):
+                self.assertFalse(detect_symbol_lookup(query).identifier)
+
+    def test_open_ended_questions_are_not_lookups(self):
+        for query in [
+            "where is the bug?", "where is the error", "how does ingestion work?",
+            "Where is settings.py?", "find views.py", "which file has README.md",
+            "find functions that call the OpenAI API", "show me similar functions",
+        ]:
+            with self.subTest(query=query):
+                self.assertIsNone(detect_symbol_lookup(query))
+
+
+class LoadTestHelperTests(SimpleTestCase):
+    def test_parse_server_config(self):
+        self.assertEqual(
+            parse_server_config("sync:4"),
+            ("sync:4", ["ai_qa_system.wsgi:application", "--worker-class=sync", "--workers=4"]),
+        )
+        self.assertEqual(
+            parse_server_config("gthread:8:4")[1],
+            ["ai_qa_system.wsgi:application", "--worker-class=gthread", "--workers=8", "--threads=4"],
+        )
+        self.assertEqual(
+            parse_server_config("asgi:2")[1],
+            ["ai_qa_system.asgi:application", "--worker-class=uvicorn.workers.UvicornWorker", "--workers=2"],
+        )
+
+    def test_parse_server_config_rejects_invalid_specs(self):
+        for spec in ["sync", "sync:four", "gthread:4", "asgi:4:4", "eventlet:4"]:
+            with self.subTest(spec=spec):
+                with self.assertRaises(CommandError):
+                    parse_server_config(spec)
+
+    def test_load_queries(self):
+        lines = [
+            '{"query": "where is process_repository?"}',
+            "",
+            '{"request_id": "user-026", "title": "Coalesce queries", "body": "..."}',
+            '{"body": "only a body"}',
+            '{"other": "ignored"}',
+            '"a JSON string"',
+            "how does ingestion work?",
+        ]
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False, encoding="utf-8") as f:
+            f.write("\n".join(lines))
+        self.addCleanup(os.remove, f.name)
+
+        self.assertEqual(load_queries(f.name), [
+            "where is process_repository?", "Coalesce queries", "only a body", "a JSON string",
+            "how does ingestion work?",
+        ])
+
+
+class ShardForChunkTests(SimpleTestCase):
+    @override_settings(DOCUMENT_SHARDS=["default"])
+    def test_single_database(self):
+        self.assertEqual(shard_for_chunk("utils.py-search_flat"), "default")
+
+    @override_settings(DOCUMENT_SHARDS=["shard_0", "shard_1", "shard_2"])
+    def test_stable_across_processes(self):
+        # crc32 is not salted per process like hash(), so chunks stay on their shard
+        self.assertEqual(shard_for_chunk("utils.py-search_flat"), "shard_2")
+        self.assertEqual(shard_for_chunk("views.py-QueryView"), "shard_1")
+        self.assertEqual(shard_for_chunk("ingest_code.py-save_to_database"), "shard_2")
+
+    @override_settings(DOCUMENT_SHARDS=["shard_0", "shard_1"])
+    def test_spreads_chunks_over_shards(self):
+        shards = [shard_for_chunk(f"module.py-function_{index}") for index in range(1000)]
+        self.assertEqual(set(shards), {"shard_0", "shard_1"})
+        self.assertGreater(shards.count("shard_0"), 400)
+        self.assertGreater(shards.count("shard_1"), 400)
+
+
+class GetDocumentDatabasesTests(SimpleTestCase):
+    @override_settings(DOCUMENT_SHARDS=["default"])
+    def test_unsharded(self):
+        self.assertEqual(get_document_databases(), ["default"])
+
+    @override_settings(DOCUMENT_SHARDS=["shard_0", "shard_1"])
+    def test_sharded_includes_default_database(self):
+        # Documents ingested before sharding was enabled stay in the default database until rebalanced
+        self.assertEqual(get_document_databases(), ["shard_0", "shard_1", "default"])
+
+
+PREPROCESSED = {
+    "how does ingestion work?": "ingestion work",
+    "how does ingestion work": "ingestion work",
+    "explain the cache": "cache explain",
+    "what is a shard?": "shard",
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BatchQueryViewTests(SimpleTestCase):
+    def setUp(self):
+        # Imported here: the views module creates OpenAI clients at import
+        from knowledge import views
+        self.views = views
+        cache.clear()
+
+        patches = {
+            "preprocess_queries": mock.Mock(side_effect=lambda queries: [PREPROCESSED[q.lower()] for q in queries]),
+            "lookup_symbols_exact": mock.Mock(side_effect=lambda names: {name: [] for name in names}),
+            "lookup_symbol": mock.Mock(return_value=[]),
+            "get_embedding_read_state": mock.Mock(return_value={"column": "embedding", "model": "test-model"}),
+            "embed_texts": mock.Mock(side_effect=lambda texts, model: [[float(i)] for i in range(len(texts))]),
+            "search_similar_documents_batch": mock.Mock(side_effect=lambda embeddings, queries, read_state: [
+                ([{"id": i, "file_path": f"{query}.py", "content": query, "docstring": ""}], [])
+                for i, query in enumerate(queries)
+            ]),
+            "complete_answer": mock.Mock(side_effect=lambda messages: f"answer: {messages[0]['content']}"),
+        }
+        for name, patched in patches.items():
+            patcher = mock.patch.object(views, name, patched)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def post(self, queries, user_id=1):
+        request = APIRequestFactory().post("/api/query/batch/", {"queries": queries}, format="json")
+        force_authenticate(request, user=User(id=user_id, username=f"user{user_id}"))
+        return self.views.BatchQueryView.as_view()(request)
+
+    def test_results_keep_input_order_and_duplicates_share_one_answer(self):
+        self.lookup_symbols_exact.side_effect = lambda names: {
+            name: [{"title": name, "kind": "function", "file_path": "ingest_code.py", "start_line": 1, "end_line": 9}]
+            for name in names
+        }
+        queries = [
+            "How does ingestion work?", "where is process_repository?", "how does ingestion work", "explain the cache",
+        ]
+        response = self.post(queries)
+
+        self.assertEqual(response.status_code, 200)
+        results = response.data["results"]
+        self.assertEqual([result["query"] for result in results], queries)
+        self.assertEqual(results[0]["answer"], "answer: ingestion work")
+        self.assertEqual(results[2]["answer"], "answer: ingestion work")
+        self.assertIn("ingestion work.py", results[0]["context"])
+        self.assertEqual(results[3]["answer"], "answer: cache explain")
+        self.assertIn("cache explain.py", results[3]["context"])
+        self.assertIn("process_repository", results[1]["answer"])
+        self.assertEqual(results[1]["matches"][0]["file_path"], "ingest_code.py")
+
+        self.preprocess_queries.assert_called_once_with(
+            ["How does ingestion work?", "how does ingestion work", "explain the cache"]
+        )
+        self.embed_texts.assert_called_once_with(["ingestion work", "cache explain"], "test-model")
+        self.assertEqual(self.complete_answer.call_count, 2)
+
+    def test_cached_answers_skip_embedding_and_completion(self):
+        cache.set(query_cache_key("ingestion work"), {"answer": "cached", "context": "cached context"})
+
+        results = self.post(["how does ingestion work?", "explain the cache"]).data["results"]
+
+        self.assertEqual(results[0]["answer"], "cached")
+        self.assertEqual(results[1]["answer"], "answer: cache explain")
+        self.embed_texts.assert_called_once_with(["cache explain"], "test-model")
+        self.assertEqual(self.complete_answer.call_count, 1)
+        self.assertEqual(cache.get(query_cache_key("cache explain"))["answer"], "answer: cache explain")
+
+    def test_completion_errors_are_reported_per_query_and_not_cached(self):
+        def complete(messages):
+            if messages[0]["content"] == "shard":
+                raise self.views.QueryPipelineError("Failed to generate response.")
+            return "ok"
+        self.complete_answer.side_effect = complete
+
+        response = self.post(["what is a shard?", "explain the cache"])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["results"][0], {"query": "what is a shard?", "error": "Failed to generate response."})
+        self.assertEqual(response.data["results"][1]["answer"], "ok")
+        self.assertIsNone(cache.get(query_cache_key("shard")))
+        self.assertIsNotNone(cache.get(query_cache_key("cache explain")))
+
+    def test_embedding_failure_fails_the_batch(self):
+        self.embed_texts.side_effect = RuntimeError("upstream down")
+
+        response = self.post(["explain the cache"])
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.data, {"error": "Embedding generation failed."})
+
+    def test_rejects_invalid_batches(self):
+        for queries in [[], "explain the cache", ["explain the cache", ""], ["explain the cache", 3]]:
+            with self.subTest(queries=queries):
+                self.assertEqual(self.post(queries).status_code, 400)
+        self.embed_texts.assert_not_called()
+
+    def test_quota_rejects_batches_over_the_hourly_limit_without_counting_them(self):
+        with mock.patch.object(self.views, "BATCH_MAX_QUERIES_PER_HOUR", 3):
+            self.assertEqual(self.post(["explain the cache", "what is a shard?"]).status_code, 200)
+            response = self.post(["explain the cache", "what is a shard?"])
+            self.assertEqual(response.status_code, 429)
+            # The rejected batch was rolled back, so the remaining query still fits
+            self.assertEqual(self.post(["how does ingestion work?"]).status_code, 200)
+            self.assertEqual(self.post(["explain the cache"]).status_code, 429)
+            # The quota is per user
+            self.assertEqual(self.post(["explain the cache"], user_id=2).status_code, 200)
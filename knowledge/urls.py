@@ -1,6 +1,8 @@
 from django.urls import path
-from .views import QueryView
+from .views import BatchQueryView, QueryStatsView, QueryView
 
 urlpatterns = [
     path('query/', QueryView.as_view(), name='query'),
+    path('query/batch/', BatchQueryView.as_view(), name='query_batch'),
+    path('query/stats/', QueryStatsView.as_view(), name='query_stats'),
 ]
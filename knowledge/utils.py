@@ -1,9 +1,18 @@
+import heapq
 import re
+import threading
+
 import spacy
 import gensim.downloader as api
 
 from django.conf import settings
-from django.db import connection
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connections
+
+from knowledge.centroids import EMBEDDING_COLUMNS
+from knowledge.embeddings import get_embedding_read_state
+from knowledge.models import Document
+from knowledge.shards import scatter
 
 from openai import OpenAI
 
@@ -12,15 +21,31 @@ from openai import OpenAI
 client = OpenAI(api_key=settings.OPENAI_API_KEY)
 
 
-# Load spaCy model
-nlp = spacy.load("en_core_web_md")
+# Language models, loaded on first use so that importing this module stays cheap
+_nlp = None
+_word_vectors = None
+_models_lock = threading.Lock()
+
+
+def load_language_models():
+    """
+    Load the spaCy model and the pre-trained word vectors, once per process.
 
+    Returns:
+        tuple: The spaCy pipeline and the word vectors.
+    """
+    global _nlp, _word_vectors
+    with _models_lock:
+        if _nlp is None:
+            # Load pre-trained word vectors
+            try:
+                _word_vectors = api.load("word2vec-google-news-300")
+            except Exception:
+                _word_vectors = api.load("glove-wiki-gigaword-100")
 
-# Load pre-trained word vectors
-try:
-    word_vectors = api.load("word2vec-google-news-300")
-except Exception:
-    word_vectors = api.load("glove-wiki-gigaword-100")
+            # Load spaCy model
+            _nlp = spacy.load("en_core_web_md")
+    return _nlp, _word_vectors
 
 
 # Domain-specific synonym dictionary
@@ -33,34 +58,319 @@ SYNONYM_DICT = {
     "documentation": ["docstring", "comment", "explanation"],
 }
 
-def search_similar_documents(query_embedding, top_k=3):
+def _rows_to_documents(rows):
+    """Convert (id, title, content, docstring, file_path, distance) rows to dictionaries."""
+    return [
+        {"id": row[0], "title": row[1], "content": row[2], "docstring": row[3], "file_path": row[4], "distance": row[5]}
+        for row in rows
+    ]
+
+
+def search_flat(embedding_array, top_k, column="embedding", using="default"):
     """
-    Search for similar documents based on the provided query embedding.
+    Search every document for the nearest embeddings.
 
     Args:
-        query_embedding (list): The embedding vector of the query.
-        top_k (int, optional): The number of top results to return. Defaults to 3.
+        embedding_array (str): The query embedding as a pgvector literal.
+        top_k (int): The number of top results to return.
+        column (str, optional): The embedding column to search. Defaults to "embedding".
+        using (str, optional): The database alias (shard) to search. Defaults to "default".
 
     Returns:
         list: A list of dictionaries containing document details and their distances.
     """
-    embedding_array = f"[{','.join(map(str, query_embedding))}]"
-    with connection.cursor() as cursor:
+    if column not in EMBEDDING_COLUMNS:
+        raise ValueError(f"Unknown embedding column: {column}")
+
+    with connections[using].cursor() as cursor:
         cursor.execute(
-            """
-            SELECT id, title, content, docstring, file_path, embedding <=> %s::vector AS distance
+            f"""
+            SELECT id, title, content, docstring, file_path, {column} <=> %s::vector AS distance
             FROM document
             ORDER BY distance ASC
             LIMIT %s;
             """,
             [embedding_array, top_k]
         )
-        results = cursor.fetchall()
+        return _rows_to_documents(cursor.fetchall())
+
+
+def search_hierarchical(embedding_array, top_k, top_files, top_classes, column="embedding", model=None, using="default"):
+    """
+    Search documents only within the files whose centroids are nearest to the query.
+
+    Args:
+        embedding_array (str): The query embedding as a pgvector literal.
+        top_k (int): The number of top results to return.
+        top_files (int): The number of files picked by file centroid similarity.
+        top_classes (int): The number of classes picked by class centroid similarity;
+            their files are searched as well.
+        column (str, optional): The embedding column to search. Defaults to "embedding".
+        model (str, optional): The embedding model of the centroids. Defaults to settings.EMBEDDING_MODEL.
+        using (str, optional): The database alias (shard) to search. Defaults to "default".
+
+    Returns:
+        list: A list of dictionaries containing document details and their distances.
+    """
+    if column not in EMBEDDING_COLUMNS:
+        raise ValueError(f"Unknown embedding column: {column}")
+    model = model or settings.EMBEDDING_MODEL
+
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH candidate_files AS (
+                (SELECT file_path FROM code_centroid WHERE scope = 'file' AND embedding_model = %s
+                 ORDER BY embedding <=> %s::vector LIMIT %s)
+                UNION
+                (SELECT file_path FROM code_centroid WHERE scope = 'class' AND embedding_model = %s
+                 ORDER BY embedding <=> %s::vector LIMIT %s)
+            )
+            SELECT id, title, content, docstring, file_path, {column} <=> %s::vector AS distance
+            FROM document
+            WHERE file_path IN (SELECT file_path FROM candidate_files)
+            ORDER BY distance ASC
+            LIMIT %s;
+            """,
+            [model, embedding_array, top_files, model, embedding_array, top_classes, embedding_array, top_k]
+        )
+        return _rows_to_documents(cursor.fetchall())
+
+
+def _search_shard(using, embedding_array, top_k, hierarchical, read_state, top_files, top_classes, fallback):
+    """Search one shard, coarse-to-fine if requested, falling back to flat search."""
+    if hierarchical:
+        results = search_hierarchical(
+            embedding_array, top_k, top_files, top_classes,
+            column=read_state["column"], model=read_state["model"], using=using,
+        )
+        if len(results) >= top_k or not fallback:
+            return results
+    return search_flat(embedding_array, top_k, column=read_state["column"], using=using)
+
+
+def search_documents_sharded(embedding_array, top_k, hierarchical, read_state,
+                             top_files=None, top_classes=None, fallback=True):
+    """
+    Search every document shard concurrently and merge the per-shard top-k.
+
+    Args:
+        embedding_array (str): The query embedding as a pgvector literal.
+        top_k (int): The number of top results to return.
+        hierarchical (bool): Use coarse-to-fine search on each shard.
+        read_state (dict): The column and model the query was embedded for.
+        top_files (int, optional): File breadth. Defaults to settings.HIERARCHICAL_TOP_FILES.
+        top_classes (int, optional): Class breadth. Defaults to settings.HIERARCHICAL_TOP_CLASSES.
+        fallback (bool, optional): Search a shard flat when coarse-to-fine search finds
+            fewer than top_k results there. Defaults to True.
+
+    Returns:
+        tuple: The merged results, and a dictionary of per-shard latencies in seconds.
+    """
+    shard_results = scatter(
+        _search_shard, embedding_array, top_k, hierarchical, read_state,
+        top_files or settings.HIERARCHICAL_TOP_FILES, top_classes or settings.HIERARCHICAL_TOP_CLASSES, fallback,
+    )
+    results = heapq.nsmallest(
+        top_k,
+        (doc for _, docs, _ in shard_results for doc in docs if doc["distance"] is not None),
+        key=lambda doc: doc["distance"],
+    )
+    return results, {alias: latency for alias, _, latency in shard_results}
+
+
+def search_similar_documents(query_embedding, top_k=3, hierarchical=None, read_state=None):
+    """
+    Search for similar documents based on the provided query embedding.
+
+    With hierarchical search enabled, only the chunks of the files nearest to
+    the query by centroid are searched; if that yields fewer than top_k results
+    (e.g. no centroids have been computed yet), all documents are searched.
+    Every shard is searched concurrently and the results are merged.
+
+    Args:
+        query_embedding (list): The embedding vector of the query.
+        top_k (int, optional): The number of top results to return. Defaults to 3.
+        hierarchical (bool, optional): Use coarse-to-fine search. Defaults to settings.HIERARCHICAL_SEARCH.
+        read_state (dict, optional): The column and model the query was embedded for,
+            as returned by get_embedding_read_state(). Defaults to the current read state.
+
+    Returns:
+        list: A list of dictionaries containing document details and their distances.
+    """
+    embedding_array = f"[{','.join(map(str, query_embedding))}]"
+    if hierarchical is None:
+        hierarchical = settings.HIERARCHICAL_SEARCH
+    read_state = read_state or get_embedding_read_state()
+
+    results, _ = search_documents_sharded(embedding_array, top_k, hierarchical, read_state)
+    return results
+
+
+def _search_keyword_shard(using, query, top_k, threshold):
+    """Run trigram keyword search on one shard."""
+    documents = Document.objects.using(using).annotate(
+        similarity=TrigramSimilarity("title", query) + TrigramSimilarity("docstring", query)
+    ).filter(similarity__gt=threshold).order_by("-similarity")[:top_k]
     return [
-        {"id": row[0], "title": row[1], "content": row[2], "docstring": row[3], "file_path": row[4], "distance": row[5]}
-        for row in results
+        {
+            "id": doc.id, "title": doc.title, "content": doc.content, "docstring": doc.docstring,
+            "file_path": doc.file_path, "similarity": doc.similarity,
+        }
+        for doc in documents
     ]
 
+
+def search_keyword_documents(query, top_k=3, threshold=0.3):
+    """
+    Search documents whose title and docstring are similar to the query text.
+
+    Args:
+        query (str): The preprocessed query.
+        top_k (int, optional): The number of top results to return. Defaults to 3.
+        threshold (float, optional): The minimum trigram similarity. Defaults to 0.3.
+
+    Returns:
+        list: A list of dictionaries containing document details and their similarity.
+    """
+    shard_results = scatter(_search_keyword_shard, query, top_k, threshold)
+    return heapq.nlargest(
+        top_k, (doc for _, docs, _ in shard_results for doc in docs), key=lambda doc: doc["similarity"]
+    )
+
+
+def _search_batch_flat(cursor, embedding_arrays, column, top_k):
+    """Run flat top-k vector search for many queries in one statement."""
+    cursor.execute(
+        f"""
+        SELECT q.idx, r.id, r.title, r.content, r.docstring, r.file_path, r.distance
+        FROM unnest(%s::text[]) WITH ORDINALITY AS q(embedding, idx)
+        CROSS JOIN LATERAL (
+            SELECT d.id, d.title, d.content, d.docstring, d.file_path, d.{column} <=> q.embedding::vector AS distance
+            FROM document d
+            ORDER BY distance ASC
+            LIMIT %s
+        ) r
+        ORDER BY q.idx;
+        """,
+        [embedding_arrays, top_k]
+    )
+    return cursor.fetchall()
+
+
+def _search_batch_shard(using, embedding_arrays, queries, top_k, keyword_threshold, read_state):
+    """Run the single-statement hybrid batch search on one shard."""
+    column = read_state["column"]
+    results = [([], []) for _ in queries]
+
+    with connections[using].cursor() as cursor:
+        candidate_filter = ""
+        candidate_params = []
+        if settings.HIERARCHICAL_SEARCH:
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM code_centroid WHERE embedding_model = %s);", [read_state["model"]])
+            if cursor.fetchone()[0]:
+                candidate_filter = """
+                    WHERE d.file_path IN (
+                        (SELECT file_path FROM code_centroid WHERE scope = 'file' AND embedding_model = %s
+                         ORDER BY embedding <=> q.embedding::vector LIMIT %s)
+                        UNION
+                        (SELECT file_path FROM code_centroid WHERE scope = 'class' AND embedding_model = %s
+                         ORDER BY embedding <=> q.embedding::vector LIMIT %s)
+                    )
+                """
+                candidate_params = [
+                    read_state["model"], settings.HIERARCHICAL_TOP_FILES,
+                    read_state["model"], settings.HIERARCHICAL_TOP_CLASSES,
+                ]
+
+        cursor.execute(
+            f"""
+            SELECT q.idx, r.source, r.id, r.title, r.content, r.docstring, r.file_path, r.score
+            FROM unnest(%s::text[], %s::text[]) WITH ORDINALITY AS q(embedding, query, idx)
+            CROSS JOIN LATERAL (
+                (SELECT 'vector' AS source, d.id, d.title, d.content, d.docstring, d.file_path,
+                        d.{column} <=> q.embedding::vector AS score
+                 FROM document d
+                 {candidate_filter}
+                 ORDER BY score ASC
+                 LIMIT %s)
+                UNION ALL
+                (SELECT 'keyword' AS source, d.id, d.title, d.content, d.docstring, d.file_path,
+                        similarity(d.title, q.query) + similarity(d.docstring, q.query) AS score
+                 FROM document d
+                 WHERE similarity(d.title, q.query) + similarity(d.docstring, q.query) > %s
+                 ORDER BY score DESC
+                 LIMIT %s)
+            ) r
+            ORDER BY q.idx;
+            """,
+            [embedding_arrays, list(queries), *candidate_params, top_k, keyword_threshold, top_k]
+        )
+        rows = cursor.fetchall()
+
+        for idx, source, doc_id, title, content, docstring, file_path, score in rows:
+            vector_results, keyword_results = results[idx - 1]
+            doc = {"id": doc_id, "title": title, "content": content, "docstring": docstring, "file_path": file_path}
+            if source == "vector":
+                if score is not None:
+                    vector_results.append({**doc, "distance": score})
+            else:
+                keyword_results.append({**doc, "similarity": score})
+
+        # Like _search_shard, queries whose centroid-selected files hold fewer than
+        # top_k chunks are searched flat, so both endpoints get the same context
+        short = [index for index, (vector_results, _) in enumerate(results) if len(vector_results) < top_k]
+        if candidate_filter and short:
+            rows = _search_batch_flat(cursor, [embedding_arrays[index] for index in short], column, top_k)
+            for index in short:
+                results[index][0].clear()
+            for idx, *row in rows:
+                if row[-1] is not None:
+                    results[short[idx - 1]][0].extend(_rows_to_documents([row]))
+    return results
+
+
+def search_similar_documents_batch(query_embeddings, queries, top_k=3, keyword_threshold=0.3, read_state=None):
+    """
+    Run hybrid (vector + trigram keyword) search for many queries in one SQL statement per shard.
+
+    The queries are unnested into rows and each row runs its own top-k vector
+    and keyword searches through a LATERAL join. Vector search is restricted to
+    centroid-selected files when hierarchical search is enabled and centroids
+    exist; queries for which that finds fewer than top_k chunks on a shard are
+    searched flat there with a second statement, as search_similar_documents does.
+
+    Args:
+        query_embeddings (list): The embedding vector of each query.
+        queries (list): The preprocessed text of each query, in the same order.
+        top_k (int, optional): The number of results per query and search type. Defaults to 3.
+        keyword_threshold (float, optional): The minimum trigram similarity. Defaults to 0.3.
+        read_state (dict, optional): The column and model the queries were embedded for,
+            as returned by get_embedding_read_state(). Defaults to the current read state.
+
+    Returns:
+        list: For each query, a (vector_results, keyword_results) tuple of lists of
+        dictionaries containing document details.
+    """
+    if not queries:
+        return []
+    embedding_arrays = [f"[{','.join(map(str, embedding))}]" for embedding in query_embeddings]
+    read_state = read_state or get_embedding_read_state()
+    if read_state["column"] not in EMBEDDING_COLUMNS:
+        raise ValueError(f"Unknown embedding column: {read_state['column']}")
+
+    shard_results = scatter(_search_batch_shard, embedding_arrays, queries, top_k, keyword_threshold, read_state)
+
+    results = []
+    for index in range(len(queries)):
+        vector_docs = (doc for _, docs, _ in shard_results for doc in docs[index][0])
+        keyword_docs = (doc for _, docs, _ in shard_results for doc in docs[index][1])
+        results.append((
+            heapq.nsmallest(top_k, vector_docs, key=lambda doc: doc["distance"]),
+            heapq.nlargest(top_k, keyword_docs, key=lambda doc: doc["similarity"]),
+        ))
+    return results
+
 def get_word_embeddings(words):
     """
     Fetch embeddings for words from OpenAI API.
@@ -71,7 +381,7 @@ def get_word_embeddings(words):
     Returns:
         list: The embedding vector for the input words.
     """
-    response = client.embeddings.create(input=" ".join(words), model="text-embedding-ada-002")
+    response = client.embeddings.create(input=" ".join(words), model=get_embedding_read_state()["model"])
     return response.data[0].embedding  # Return the embedding vector
 
 def expand_with_embeddings(words):
@@ -86,31 +396,53 @@ def expand_with_embeddings(words):
     """
     return words  # Currently, embeddings are fetched but not modifying query terms
 
-def preprocess_query(query):
-    """
-    Improved Query Preprocessing with Performance Optimizations.
-
-    Args:
-        query (str): The input query to preprocess.
-
-    Returns:
-        str: The cleaned and expanded query.
-    """
+def _clean_query(query):
+    """Lowercase a query and strip special characters before parsing."""
     query = query.lower()
-    query = re.sub(r"[^a-z0-9\s]", "", query)  # Remove special chars
+    return re.sub(r"[^a-z0-9\s]", "", query)  # Remove special chars
 
-    doc = nlp(query)
 
+def _expand_query(doc):
+    """Build the cleaned and expanded query from its spaCy parse."""
     # Extract useful tokens (NOUN, VERB, PROPN) and remove stopwords
     words = {token.lemma_ for token in doc if token.pos_ in {"NOUN", "VERB", "PROPN"} and not token.is_stop}
 
     # Expand with synonyms
     words.update({syn for word in words if word in SYNONYM_DICT for syn in SYNONYM_DICT[word]})
 
-    # Convert to a list for API request
-    word_list = list(words)
+    # Convert to a sorted list, so the query text (and its cache key) does not depend on set order
+    word_list = sorted(words)
 
     # Expand words with embeddings (this function currently doesn't modify words)
     expanded_words = expand_with_embeddings(word_list)
 
     return " ".join(expanded_words)  # Return cleaned & expanded query
+
+
+def preprocess_query(query):
+    """
+    Improved Query Preprocessing with Performance Optimizations.
+
+    Args:
+        query (str): The input query to preprocess.
+
+    Returns:
+        str: The cleaned and expanded query, or the lowercased query if no useful words are left.
+    """
+    nlp, _ = load_language_models()
+    return _expand_query(nlp(_clean_query(query))) or query.lower().strip()
+
+
+def preprocess_queries(queries):
+    """
+    Preprocess many queries at once, parsing them in batches with nlp.pipe.
+
+    Args:
+        queries (list): The input queries to preprocess.
+
+    Returns:
+        list: The queries as preprocess_query returns them, in input order.
+    """
+    nlp, _ = load_language_models()
+    docs = nlp.pipe(_clean_query(query) for query in queries)
+    return [_expand_query(doc) or query.lower().strip() for query, doc in zip(queries, docs)]
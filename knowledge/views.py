@@ -1,16 +1,29 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from django.contrib.auth.decorators import login_required
-from django.contrib.postgres.search import TrigramSimilarity
 from django.core.cache import cache
 from django.conf import settings
 from django.shortcuts import redirect, render
+from django.utils.decorators import method_decorator
 from django.utils.timezone import now, timedelta
 
 from rest_framework.views import APIView
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 
-from knowledge.models import ChatSession, Message, Document
-from knowledge.utils import search_similar_documents, preprocess_query
+from knowledge.embeddings import embed_texts, get_embedding_read_state
+from knowledge.models import ChatSession, Message
+from knowledge.profiling import profile_request
+from knowledge.symbols import detect_symbol_lookup, format_symbol_answer, lookup_symbol, lookup_symbols_exact
+from knowledge.singleflight import get_single_flight_saved_calls, query_cache_key, single_flight
+from knowledge.utils import (
+    preprocess_queries,
+    preprocess_query,
+    search_keyword_documents,
+    search_similar_documents,
+    search_similar_documents_batch,
+)
 
 from openai import OpenAI
 
@@ -20,8 +33,125 @@ import tiktoken
 client = OpenAI(api_key=settings.OPENAI_API_KEY)
 TOKEN_LIMIT = 3000
 MAX_QUERIES_PER_HOUR = 100
+BATCH_MAX_QUERIES = 500
+BATCH_MAX_QUERIES_PER_HOUR = 1000
+BATCH_COMPLETION_CONCURRENCY = 8
+
+
+def consume_batch_quota(user, count):
+    """
+    Count a user's batch queries against BATCH_MAX_QUERIES_PER_HOUR.
+
+    Args:
+        user (User): The requesting user.
+        count (int): The number of queries in the batch.
+
+    Returns:
+        bool: True if the batch fits in the user's quota for the current hour.
+    """
+    key = f"batch_query_quota_{user.pk}_{int(time.time() // 3600)}"
+    cache.add(key, 0, timeout=3600)
+    try:
+        used = cache.incr(key, count)
+    except ValueError:
+        # The key expired between add() and incr().
+        cache.set(key, count, timeout=3600)
+        used = count
+    if used > BATCH_MAX_QUERIES_PER_HOUR:
+        cache.decr(key, count)
+        return False
+    return True
+
+
+class QueryPipelineError(Exception):
+    """Raised when a step of the answer pipeline fails; the message is returned to the client."""
+
+
+def build_context(vector_results, keyword_results):
+    """
+    Merge vector and keyword search results into the context passed to the model.
+
+    Args:
+        vector_results (list): Documents found by vector search.
+        keyword_results (list): Documents found by keyword search.
+
+    Returns:
+        str: The formatted context, or a placeholder if nothing was found.
+    """
+    results = {doc["id"]: doc for doc in vector_results}
+    for doc in keyword_results:
+        if doc["id"] not in results:
+            results[doc["id"]] = doc
+
+    return "\n\n".join([
+        f"File: {doc['file_path']}\n{doc['content']}\n\nDocstring: {doc['docstring']}"
+        for doc in results.values()
+    ]) if results else "No relevant context found."
+
+
+def complete_answer(messages):
+    """
+    Generate an AI answer for the given chat messages.
+
+    Args:
+        messages (list): The chat messages, including the query and its context.
+
+    Returns:
+        str: The generated answer.
+
+    Raises:
+        QueryPipelineError: If the completion fails.
+    """
+    try:
+        completion_response = client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=messages,
+            max_tokens=500
+        )
+        return completion_response.choices[0].message.content.strip()
+    except Exception as e:
+        raise QueryPipelineError("Failed to generate response.") from e
+
+
+def generate_answer(query, chat_history):
+    """
+    Retrieve context for a query and generate an AI answer.
+
+    Args:
+        query (str): The preprocessed user query.
+        chat_history (list): The chat messages sent to the model, ending with the query.
+
+    Returns:
+        dict: The generated answer and the context it was based on.
+
+    Raises:
+        QueryPipelineError: If embedding generation or the completion fails.
+    """
+    chat_history = list(chat_history)
+
+    # Generate embedding with the model of the column searches currently read
+    read_state = get_embedding_read_state()
+    try:
+        query_embedding = embed_texts([query], read_state["model"])[0]
+    except Exception as e:
+        raise QueryPipelineError("Embedding generation failed.") from e
+
+    # Hybrid Search: Vector + Keyword
+    vector_results = search_similar_documents(query_embedding, read_state=read_state)
+
+    # Use TrigramSimilarity for better text search
+    keyword_results = search_keyword_documents(query)
+
+    # Merge results
+    context = build_context(vector_results, keyword_results)
+    chat_history.append({"role": "system", "content": f"Relevant context:\n\n{context}"})
+
+    # AI Response
+    answer = complete_answer(chat_history)
+    return {"answer": answer, "context": context}
 
 
+@method_decorator(profile_request, name="dispatch")
 class QueryView(APIView):
     """
     API view to handle user queries and generate AI responses.
@@ -47,9 +177,6 @@ class QueryView(APIView):
         if not query:
             return Response({"error": "Query is required"}, status=400)
 
-        # Normalize and expand query (e.g., synonyms, tokenization)
-        query = preprocess_query(query)
-
         if not session_id:
             chat_session = ChatSession.objects.create()
             session_id = str(chat_session.id)
@@ -65,6 +192,19 @@ class QueryView(APIView):
         if user_message_count >= MAX_QUERIES_PER_HOUR:
             return Response({"error": "Query limit reached. Try again in an hour."}, status=429)
 
+        # Fast path: answer "where is X" questions from the symbol index, without an LLM call
+        symbol = detect_symbol_lookup(query)
+        if symbol:
+            matches = lookup_symbol(symbol.name, fuzzy=symbol.identifier)
+            if matches:
+                answer = format_symbol_answer(symbol.name, matches)
+                Message.objects.create(chat_session=chat_session, role="user", content=query)
+                Message.objects.create(chat_session=chat_session, role="assistant", content=answer)
+                return Response({"answer": answer, "context": "", "matches": matches, "session_id": session_id})
+
+        # Normalize and expand query (e.g., synonyms, tokenization)
+        query = preprocess_query(query)
+
         # Fetch and clean chat history
         messages = Message.objects.filter(chat_session=chat_session).order_by("created_at")
         chat_history = [{"role": msg.role, "content": msg.content} for msg in messages]
@@ -93,61 +233,153 @@ class QueryView(APIView):
         chat_history.append({"role": "user", "content": query})
 
         # Check cache for similar queries
-        cache_key = f"query_response_{hash(query)}"
+        cache_key = query_cache_key(query)
         cached_response = cache.get(cache_key)
         if cached_response:
             return Response({"answer": cached_response["answer"], "context": cached_response["context"], "session_id": session_id})
 
-        # Generate embedding
+        # Identical concurrent queries share a single upstream pipeline run,
+        # which also caches the response for future queries.
         try:
-            embedding_response = client.embeddings.create(input=query, model="text-embedding-ada-002")
-            query_embedding = embedding_response.data[0].embedding
-        except Exception as e:
-            return Response({"error": "Embedding generation failed."}, status=500)
+            result = single_flight(cache_key, lambda: generate_answer(query, chat_history))
+        except QueryPipelineError as e:
+            return Response({"error": str(e)}, status=500)
+        answer, context = result["answer"], result["context"]
+
+        # Store message history
+        Message.objects.create(chat_session=chat_session, role="user", content=query)
+        Message.objects.create(chat_session=chat_session, role="assistant", content=answer)
 
-        # Hybrid Search: Vector + Keyword
-        vector_results = search_similar_documents(query_embedding)
+        return Response({"answer": answer, "context": context, "session_id": session_id})
 
-        # Use TrigramSimilarity for better text search
-        keyword_results = Document.objects.annotate(
-            similarity=TrigramSimilarity("title", query) + TrigramSimilarity("docstring", query)
-        ).filter(similarity__gt=0.3).order_by("-similarity")[:3]
 
-        # Merge results
-        results = {doc["id"]: doc for doc in vector_results}
-        for doc in keyword_results:
-            if doc.id not in results:
-                results[doc.id] = {"id": doc.id, "title": doc.title, "content": doc.content, "file_path": doc.file_path}
+class BatchQueryView(APIView):
+    """
+    API view to answer many independent queries in one request.
+
+    All queries are parsed together, embedded with a single embeddings request
+    and retrieved with a single SQL statement; completions then run with
+    bounded parallelism. Batch queries are stateless: they have no chat session,
+    and each user may send BATCH_MAX_QUERIES_PER_HOUR queries per hour.
+    """
+    permission_classes = [IsAuthenticated]
 
-        context = "\n\n".join([
-            f"File: {doc['file_path']}\n{doc['content']}\n\nDocstring: {doc['docstring']}"
-            for doc in results.values()
-        ]) if results else "No relevant context found."
-        chat_history.append({"role": "system", "content": f"Relevant context:\n\n{context}"})
+    def post(self, request):
+        """
+        Handle POST request to process a batch of queries.
 
+        Args:
+            request (Request): The incoming request object containing a "queries" list.
 
-        # AI Response
-        try:
-            completion_response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=chat_history,
-                max_tokens=500
+        Returns:
+            Response: JSON response with one result per query, in input order.
+        """
+        queries = request.data.get("queries")
+
+        if not isinstance(queries, list) or not queries:
+            return Response({"error": "Queries must be a non-empty list"}, status=400)
+        if len(queries) > BATCH_MAX_QUERIES:
+            return Response({"error": f"At most {BATCH_MAX_QUERIES} queries per batch"}, status=400)
+        if not all(isinstance(query, str) and query.strip() for query in queries):
+            return Response({"error": "Every query must be a non-empty string"}, status=400)
+
+        if not consume_batch_quota(request.user, len(queries)):
+            return Response(
+                {"error": f"Batch query limit of {BATCH_MAX_QUERIES_PER_HOUR} queries per hour reached."},
+                status=429,
             )
-            answer = completion_response.choices[0].message.content.strip()
-        except Exception as e:
-            return Response({"error": "Failed to generate response."}, status=500)
 
-        # Store message history
-        Message.objects.create(chat_session=chat_session, role="user", content=query)
-        Message.objects.create(chat_session=chat_session, role="assistant", content=answer)
+        results = [None] * len(queries)
+
+        # Symbol lookups are answered from the identifier index: exact names for
+        # all queries in one statement, the fuzzy tiers only for identifiers left
+        symbols = [detect_symbol_lookup(query) for query in queries]
+        exact_matches = lookup_symbols_exact(symbol.name for symbol in symbols if symbol)
+        unanswered = []
+        for index, (query, symbol) in enumerate(zip(queries, symbols)):
+            matches = exact_matches[symbol.name] if symbol else []
+            if symbol and not matches and symbol.identifier:
+                matches = lookup_symbol(symbol.name, exact=False)
+            if matches:
+                results[index] = {"query": query, "answer": format_symbol_answer(symbol.name, matches), "context": "", "matches": matches}
+            else:
+                unanswered.append(index)
+
+        # The other queries are parsed together
+        pending = {}
+        processed_queries = preprocess_queries([queries[index] for index in unanswered])
+        for index, processed in zip(unanswered, processed_queries):
+            pending.setdefault(processed, []).append(index)
+
+        # Cached answers, then a single embedding request for the remaining unique queries
+        cache_keys = {processed: query_cache_key(processed) for processed in pending}
+        cached = cache.get_many(cache_keys.values())
+        uncached = [processed for processed in pending if cache_keys[processed] not in cached]
+        answers = {processed: cached[cache_keys[processed]] for processed in pending if cache_keys[processed] in cached}
+
+        if uncached:
+            read_state = get_embedding_read_state()
+            try:
+                query_embeddings = embed_texts(uncached, read_state["model"])
+            except Exception as e:
+                return Response({"error": "Embedding generation failed."}, status=500)
+
+            # Hybrid Search for all queries in one statement
+            search_results = search_similar_documents_batch(query_embeddings, uncached, read_state=read_state)
+            contexts = [build_context(vector_results, keyword_results) for vector_results, keyword_results in search_results]
+
+            def answer_query(item):
+                processed, context = item
+                messages = [
+                    {"role": "user", "content": processed},
+                    {"role": "system", "content": f"Relevant context:\n\n{context}"},
+                ]
+                try:
+                    return {"answer": complete_answer(messages), "context": context}
+                except QueryPipelineError as e:
+                    return {"error": str(e)}
+
+            with ThreadPoolExecutor(max_workers=BATCH_COMPLETION_CONCURRENCY) as executor:
+                generated = list(executor.map(answer_query, zip(uncached, contexts)))
+
+            answers.update(zip(uncached, generated))
+            cache.set_many(
+                {cache_keys[processed]: result for processed, result in zip(uncached, generated) if "error" not in result},
+                timeout=3600,
+            )
 
-        # Cache response for future queries
-        cache.set(cache_key, {"answer": answer, "context": context}, timeout=3600)
+        for processed, indexes in pending.items():
+            for index in indexes:
+                results[index] = {"query": queries[index], **answers[processed]}
 
-        return Response({"answer": answer, "context": context, "session_id": session_id})
+        return Response({"results": results})
+
+
+class QueryStatsView(APIView):
+    """
+    Staff-only API view reporting how many upstream calls query coalescing saved.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        """
+        Handle GET request for the query pipeline statistics.
+
+        Args:
+            request (Request): The incoming request object.
+
+        Returns:
+            Response: JSON response with the number of saved upstream calls and the cache
+            backend, which tells whether the count covers all workers.
+        """
+        return Response({
+            "single_flight_saved_calls": get_single_flight_saved_calls(),
+            "cache_backend": settings.CACHES["default"]["BACKEND"],
+        })
 
 
 @login_required
+@profile_request
 def chat_view(request):
     """
     View to render the chat interface.